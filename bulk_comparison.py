@@ -0,0 +1,210 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Headless bulk comparison (regression checks).
+#
+# Matches the originals of one directory with the processed images of another
+# one (same file name without extension, plus an optional suffix), computes the
+# ComparisonModel metrics (MSE / SSIM) in parallel worker processes and writes
+# a CSV or JSON report with per-image metrics and timings.
+#
+# Use : python bulk_comparison.py ORIGINALS_DIR RESULTS_DIR report.csv
+#                                 [--suffix _final] [--heatmaps DIR] [--workers N]
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2 as cv
+
+from comparison_model import ComparisonModel
+import thread_policy
+
+ORIGINAL_EXTENSIONS = (".fits", ".fit", ".png", ".jpg")
+PROCESSED_EXTENSIONS = (".png", ".jpg", ".fits", ".fit")
+
+REPORT_FIELDS = (
+    "name",
+    "original",
+    "processed",
+    "status",
+    "error",
+    "mse",
+    "ssim",
+    "heatmap",
+    "load_time",
+    "metrics_time",
+    "heatmap_time",
+    "total_time",
+)
+
+
+def _index_directory(directory, extensions, suffix=""):
+    """Maps "file name without extension and suffix" to its path."""
+    index = {}
+    for entry in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(entry)
+        if ext.lower() not in extensions:
+            continue
+        if suffix:
+            if not stem.endswith(suffix):
+                continue
+            stem = stem[: -len(suffix)]
+        # Keep the first extension of the priority list when several exist
+        if stem in index:
+            current = os.path.splitext(index[stem])[1].lower()
+            if extensions.index(current) <= extensions.index(ext.lower()):
+                continue
+        index[stem] = os.path.join(directory, entry)
+    return index
+
+
+def match_pairs(originals_dir, results_dir, suffix=""):
+    """Returns the (name, original, processed) pairs and the unmatched names."""
+    originals = _index_directory(originals_dir, ORIGINAL_EXTENSIONS)
+    processed = _index_directory(results_dir, PROCESSED_EXTENSIONS, suffix)
+
+    pairs = [
+        (name, originals[name], processed[name])
+        for name in sorted(originals)
+        if name in processed
+    ]
+    unmatched = sorted(set(originals) ^ set(processed))
+    return pairs, unmatched
+
+
+def compare_pair(name, original_path, processed_path, heatmap_dir=None):
+    """Executed in a worker process. Returns one report row."""
+    row = {"name": name, "original": original_path, "processed": processed_path}
+    model = ComparisonModel()
+    t0 = time.perf_counter()
+
+    try:
+        model.original_image = model.load_image(original_path)
+        model.processed_image = model.load_image(processed_path)
+        if model.original_image is None or model.processed_image is None:
+            raise ValueError("Image illisible")
+        t1 = time.perf_counter()
+
+        row["mse"], row["ssim"] = model.calculate_metrics()
+        t2 = time.perf_counter()
+
+        if heatmap_dir:
+            heatmap_path = os.path.join(heatmap_dir, f"{name}_diff.png")
+            cv.imwrite(heatmap_path, model.compute_difference())
+            row["heatmap"] = heatmap_path
+        t3 = time.perf_counter()
+
+        row.update(
+            status="ok",
+            load_time=t1 - t0,
+            metrics_time=t2 - t1,
+            heatmap_time=t3 - t2,
+        )
+    except Exception as e:
+        row.update(status="error", error=str(e))
+
+    row["total_time"] = time.perf_counter() - t0
+    return row
+
+
+def run_comparison(
+    originals_dir, results_dir, suffix="", heatmap_dir=None, workers=None
+):
+    """Compares every matched pair in parallel. Returns (rows, unmatched)."""
+    pairs, unmatched = match_pairs(originals_dir, results_dir, suffix)
+    if heatmap_dir:
+        os.makedirs(heatmap_dir, exist_ok=True)
+
+    if not pairs:
+        return [], unmatched
+
+    # Cores split between the workers (see thread_policy.py)
+    plan = thread_policy.plan("batch", len(pairs), workers)
+    workers = plan.workers
+    names, originals, processed = zip(*pairs)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=thread_policy.init_worker,
+        initargs=(plan.threads,),
+    ) as pool:
+        rows = list(
+            pool.map(
+                compare_pair,
+                names,
+                originals,
+                processed,
+                [heatmap_dir] * len(pairs),
+                # Small chunks keep every worker busy until the end
+                chunksize=max(1, len(pairs) // (workers * 4)),
+            )
+        )
+    return rows, unmatched
+
+
+def write_report(rows, path, summary=None):
+    """Writes the rows as CSV, or as JSON when the path ends with .json."""
+    if path.lower().endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary or {}, "images": rows}, f, indent=2)
+        return
+
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def summarize(rows, unmatched, elapsed):
+    ok = [r for r in rows if r["status"] == "ok"]
+    summary = {
+        "pairs": len(rows),
+        "errors": len(rows) - len(ok),
+        "unmatched": unmatched,
+        "elapsed": elapsed,
+    }
+    if ok:
+        summary["mean_mse"] = sum(r["mse"] for r in ok) / len(ok)
+        summary["mean_ssim"] = sum(r["ssim"] for r in ok) / len(ok)
+        summary["min_ssim"] = min(r["ssim"] for r in ok)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Comparaison en masse (sans GUI)")
+    parser.add_argument("originals_dir")
+    parser.add_argument("results_dir")
+    parser.add_argument("report", help="Rapport .csv ou .json")
+    parser.add_argument(
+        "--suffix", default="", help="Suffixe des images traitées (ex. _final)"
+    )
+    parser.add_argument("--heatmaps", default=None, help="Dossier des cartes")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows, unmatched = run_comparison(
+        args.originals_dir, args.results_dir, args.suffix, args.heatmaps, args.workers
+    )
+    summary = summarize(rows, unmatched, time.perf_counter() - start)
+    write_report(rows, args.report, summary)
+
+    print(
+        f"{summary['pairs']} paires comparées ({summary['errors']} erreurs, "
+        f"{len(unmatched)} sans correspondance) en {summary['elapsed']:.1f} s"
+    )
+    if "mean_ssim" in summary:
+        print(
+            f"MSE moyen : {summary['mean_mse']:.2f} | "
+            f"SSIM moyen : {summary['mean_ssim']:.4f} | "
+            f"SSIM min : {summary['min_ssim']:.4f}"
+        )
+    print(f"Rapport : {args.report}")
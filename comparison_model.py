@@ -0,0 +1,120 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Model of the Comparison Mode, without Qt : it is also used by the worker
+# processes of bulk_comparison.py.
+
+import cv2 as cv
+from skimage.metrics import structural_similarity, mean_squared_error
+
+import star_pipeline
+from tile_pyramid import HeatmapPyramid, TilePyramid, match_channels
+
+
+class ComparisonModel:
+    def __init__(self, stretch_method="linear"):
+        self.stretch_method = stretch_method
+        self.original_image = None
+        self.processed_image = None
+        # Tiled pyramids of the displayed panes (processed image matched to
+        # the original size, heatmap built on demand)
+        self.original_tiles = None
+        self.processed_tiles = None
+        self.heatmap_tiles = None
+
+    def load_image(self, filepath):
+        """Updates the image from a file (FITS or standard format)."""
+        if filepath.lower().endswith((".fits", ".fit")):
+            try:
+                # Normalization for display
+                return star_pipeline.load_image(filepath, self.stretch_method)
+            except Exception as e:
+                print(f"Error loading FITS: {e}")
+                return None
+        else:
+            return cv.imread(filepath)
+
+    def set_images(self, original=None, processed=None):
+        """Replaces one or both images and resets the tile pyramids."""
+        if original is not None:
+            self.original_image = original
+            self.original_tiles = TilePyramid(original)
+        if processed is not None:
+            self.processed_image = processed
+        if self.processed_image is not None:
+            img = self.processed_image
+            if self.original_image is not None:
+                h1, w1 = self.original_image.shape[:2]
+                if img.shape[:2] != (h1, w1):
+                    img = cv.resize(img, (w1, h1))  # Match size
+            self.processed_tiles = TilePyramid(img)
+        self.heatmap_tiles = None
+
+    def difference_tiles(self):
+        """Heatmap pyramid, tiles being computed only when displayed."""
+        if self.original_tiles is None or self.processed_tiles is None:
+            return None
+        if self.heatmap_tiles is None:
+            self.heatmap_tiles = HeatmapPyramid(
+                self.original_tiles, self.processed_tiles
+            )
+        return self.heatmap_tiles
+
+    def compute_difference(self):
+        """Calculates difference and applies a heatmap (Red=Max Diff, Blue=Min Diff)."""
+        if self.original_image is None or self.processed_image is None:
+            return None
+
+        h1, w1 = self.original_image.shape[:2]
+        img1 = self.original_image
+        img2 = cv.resize(self.processed_image, (w1, h1))  # Match size
+
+        # Match channels (e.g. monochrome FITS against a PNG read as BGR)
+        img1, img2 = match_channels(img1, img2)
+
+        # 1. Absolute difference
+        diff = cv.absdiff(img1, img2)
+
+        # 2. Convert to grayscale (single intensity layer)
+        if len(diff.shape) == 3:
+            diff_gray = cv.cvtColor(diff, cv.COLOR_BGR2GRAY)
+        else:
+            diff_gray = diff
+
+        # 3. Min-Max Normalization to use the full color spectrum
+        # This allows visualizing relative differences like a weather map
+        diff_norm = cv.normalize(diff_gray, None, 0, 255, cv.NORM_MINMAX)
+
+        # 4. Apply JET Colormap (Blue=Cold/Low diff -> Red=Hot/High diff)
+        heatmap = cv.applyColorMap(diff_norm, cv.COLORMAP_JET)
+
+        return heatmap
+
+    def calculate_metrics(self):
+        """Calculates MSE and SSIM between the two images."""
+        if self.original_image is None or self.processed_image is None:
+            return None
+
+        # Resize to match dimensions
+        h1, w1 = self.original_image.shape[:2]
+        img2 = cv.resize(self.processed_image, (w1, h1))
+
+        # Convert to grayscale for metrics (Standard practice for SSIM)
+        if len(self.original_image.shape) == 3:
+            gray1 = cv.cvtColor(self.original_image, cv.COLOR_BGR2GRAY)
+        else:
+            gray1 = self.original_image
+
+        if len(img2.shape) == 3:
+            gray2 = cv.cvtColor(img2, cv.COLOR_BGR2GRAY)
+        else:
+            gray2 = img2
+
+        mse = mean_squared_error(gray1, gray2)
+        ssim_val = structural_similarity(gray1, gray2, data_range=255)
+
+        return mse, ssim_val
@@ -29,20 +29,22 @@ import cv2 as cv
 import numpy as np
 import os
 import sys
+import time
+
+import packed_mask
+import star_pipeline
+import stretch
+import thread_policy
 
 # =================================================================
 # CONFIGURATION VARIABLES
 # =================================================================
-if len(sys.argv) > 1:
-    FITS_FILE = sys.argv[1]
-else:
-    print("Veuillez choisir une image FITS.")
-    # Use input to ask for file if not provided
-    user_file = input("Entrez le chemin du fichier FITS (par défaut ./examples/m31_star.fits) : ").strip()
-    if user_file:
-        FITS_FILE = user_file
-    else:
-        FITS_FILE = "./examples/m31_star.fits"
+# Normalization : "linear", "percentile", "asinh" or "midtone"
+STRETCH = "linear"
+# Working type : "uint8" (historical), "uint16" or "float32". Above 8 bits the
+# whole pipeline keeps the dynamic range of the FITS data, the images are
+# saved as 16-bit PNG and the final image also as a float32 FITS file.
+WORKING_DTYPE = "uint8"
 
 # Preventive erosion settings (lower peaks of light)
 IMAGE_EROSION_SIZE = 3  # 3x3 zone
@@ -58,82 +60,121 @@ MASK_DILATE_ITER = 3  # Orange/white halos cover
 INPAINT_RADIUS = 5  # Reconstruction radius
 REDUCTION_ALPHA = 0.6  # Reduction intensity (0.6 = 60% star reduction)
 BLUR_SIZE = 15  # Transition blur (for fusion)
+
+# Per-star mode : radius and strength of each star from its size and
+# brightness, processed in a window around it (see star_catalog.py)
+ADAPTIVE = False
 # =================================================================
 
-# 1. Creating output directory
-if not os.path.exists("./results"):
-    os.makedirs("./results")
-
-# 2. Opening and reading FITS file
-hdul = fits.open(FITS_FILE)
-data = hdul[0].data
-
-# 3. Preparation and save ORIGINAL image
-# Normalization of FITS data (0.0 to 1.0)
-data_norm = (data - data.min()) / (data.max() - data.min())
-
-
-if data.ndim == 3:
-    if data.shape[0] == 3:  # adjusting axes if needed
-        data_norm = np.transpose(data_norm, (1, 2, 0))
-    plt.imsave("./results/original.png", data_norm)
-    # Conversion to uint8 BGR for OpenCV
-    image = (data_norm * 255).astype("uint8")
-    image = cv.cvtColor(image, cv.COLOR_RGB2BGR)
-else:
-    plt.imsave("./results/original.png", data_norm, cmap="gray")
-    image = (data_norm * 255).astype("uint8")
-
-##### Phase 1 : Full image erosion
-# We slightly lower all sparkly points intensity
-kernel_img = np.ones((IMAGE_EROSION_SIZE, IMAGE_EROSION_SIZE), np.uint8)
-image_eroded_step1 = cv.erode(image, kernel_img, iterations=IMAGE_EROSION_ITER)
-
-## step A : Creating and cleaning the star mask
-gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
-mask = cv.adaptiveThreshold(
-    gray, 255, cv.ADAPTIVE_THRESH_GAUSSIAN_C, cv.THRESH_BINARY, MASK_BLOCK, MASK_C
-)
-
-# Opening to delete the mask parasital noise
-kernel_m = np.ones((OPENING_KERNEL_SIZE, OPENING_KERNEL_SIZE), np.uint8)
-mask_cleaned = cv.morphologyEx(mask, cv.MORPH_OPEN, kernel_m)
-
-# Dilating to encompass halos around the stars
-mask_dilated = cv.dilate(mask_cleaned, kernel_m, iterations=MASK_DILATE_ITER)
-
-#### PHASE 2 : Inpainting (Restoration for the ERODED image)
-# Creating an image where stars are fully deleted
-print("Calcul de l'Inpainting...")
-eroded_final = cv.inpaint(
-    image_eroded_step1, mask_dilated, INPAINT_RADIUS, cv.INPAINT_TELEA
-)
-
-# Saving intermediate results (0 stars)
-cv.imwrite("./results/eroded.png", eroded_final)
-
-##### Phase 3 : Final Fusion (Alpha Blending for reduction)
-# Mask border softening for a natural fusion
-mask_blurred = cv.GaussianBlur(mask_dilated, (BLUR_SIZE, BLUR_SIZE), 0)
-M = mask_blurred.astype(np.float32) / 255.0
-
-if image.ndim == 3:
-    M = np.stack([M] * 3, axis=-1)
-
-# Transition to float for fusion calculation
-Ioriginal = image.astype(np.float32)
-Ieroded = eroded_final.astype(np.float32)
-
-# Reduction application (Compromise between the original and the empty)
-# Formula : M * strength * Empty_Image + (1 - M * Strength) * Beginning_Image
-final_image_float = (M * REDUCTION_ALPHA * Ieroded) + (
-    1.0 - (M * REDUCTION_ALPHA)
-) * Ioriginal
-final_image = np.clip(final_image_float, 0, 255).astype(np.uint8)
-
-# 4. Results final saving
-cv.imwrite("./results/star_mask.png", mask_dilated)
-cv.imwrite("./results/final_phase3.png", final_image)
-
-hdul.close()
-print("Terminé ! Les 4 fichiers sont disponibles dans le dossier ./results/")
+STAGE_LABELS = {
+    "erosion": "Érosion de l'image",  # Phase 1 : lower all sparkly points
+    "mask": "Masque des étoiles",  # Threshold, opening, dilation (halos)
+    "inpaint": "Calcul de l'Inpainting",  # Phase 2 : image without stars
+    "fusion": "Fusion finale",  # Phase 3 : alpha blending for reduction
+}
+
+
+def print_progress(start):
+    """Console progress report of a run started at ``start``."""
+
+    def report(stage, done, total):
+        fraction = star_pipeline.overall_progress(stage, done, total)
+        elapsed = time.perf_counter() - start
+        line = f"\r{STAGE_LABELS[stage]:<24} {fraction:6.1%}"
+        if fraction > 0.02:
+            line += f"  (reste environ {elapsed * (1 - fraction) / fraction:.0f} s)"
+        print(f"{line:<60}", end="", flush=True)
+
+    return report
+
+
+def process_file(fits_file):
+    """Reduces the stars of a FITS file, images written to ./results/."""
+    # 1. Creating output directory
+    if not os.path.exists("./results"):
+        os.makedirs("./results")
+
+    # 2. Opening and reading FITS file
+    hdul = fits.open(fits_file)
+    data = hdul[0].data
+
+    # 3. Preparation and save ORIGINAL image
+    # Normalization of FITS data to the working type (see stretch.py for the methods)
+    image = stretch.normalize(data, STRETCH, hdul[0].header, WORKING_DTYPE)
+    high_depth = WORKING_DTYPE != "uint8"
+    if not high_depth:
+        # matplotlib gets the data in [0, 1] (not the 8-bit image), as it
+        # always did : same original.png as the historical script
+        preview = stretch.normalize(data, STRETCH, hdul[0].header, np.float32)
+
+    if data.ndim == 3:
+        if data.shape[0] == 3:  # adjusting axes if needed
+            image = np.transpose(image, (1, 2, 0))
+            if not high_depth:
+                preview = np.transpose(preview, (1, 2, 0))
+        if not high_depth:
+            plt.imsave("./results/original.png", preview)
+        # Conversion to BGR for OpenCV
+        image = cv.cvtColor(image, cv.COLOR_RGB2BGR)
+    elif not high_depth:
+        plt.imsave("./results/original.png", preview, cmap="gray")
+
+    if high_depth:
+        # 16-bit PNG (matplotlib only writes 8-bit images)
+        star_pipeline.save_image("./results/original.png", image)
+
+    # Same steps as star_pipeline.reduce_stars (phases below), with a progress
+    # report on the console
+    params = {
+        "erosion_size": IMAGE_EROSION_SIZE,
+        "erosion_iter": IMAGE_EROSION_ITER,
+        "thresh_block": MASK_BLOCK,
+        "thresh_c": MASK_C,
+        "opening_kernel": OPENING_KERNEL_SIZE,
+        "dilate_iter": MASK_DILATE_ITER,
+        "inpaint_radius": INPAINT_RADIUS,
+        "reduction_alpha": REDUCTION_ALPHA * 100,
+        "blur_kernel": BLUR_SIZE,
+        "adaptive": int(ADAPTIVE),
+    }
+
+    results = star_pipeline.reduce_stars(
+        image, params, progress=print_progress(time.perf_counter())
+    )
+    print()
+    mask_dilated = results["mask"]
+    eroded_final = results["eroded"]
+    final_image = results["final"]
+
+    # Saving intermediate results (0 stars)
+    star_pipeline.save_image("./results/eroded.png", eroded_final)
+
+    # 4. Results final saving
+    packed_mask.imwrite("./results/star_mask.png", mask_dilated)  # 1 bit per pixel
+    star_pipeline.save_image("./results/final_phase3.png", final_image)
+    if high_depth:
+        star_pipeline.save_image("./results/final_phase3.fits", final_image)
+
+    hdul.close()
+    print(f"Terminé ! Les {5 if high_depth else 4} fichiers sont disponibles dans le dossier ./results/")
+
+
+def main():
+    # One image : OpenCV and the inpainting bands use every core
+    thread_policy.apply(thread_policy.plan("interactive"))
+
+    if len(sys.argv) > 1:
+        fits_file = sys.argv[1]
+    else:
+        print("Veuillez choisir une image FITS.")
+        # Use input to ask for file if not provided
+        user_file = input("Entrez le chemin du fichier FITS (par défaut ./examples/m31_star.fits) : ").strip()
+        if user_file:
+            fits_file = user_file
+        else:
+            fits_file = "./examples/m31_star.fits"
+    process_file(fits_file)
+
+
+if __name__ == "__main__":
+    main()
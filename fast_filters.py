@@ -0,0 +1,196 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Mask stages whose cost does not depend on the kernel size.
+#
+# 1. DILATION : n dilations by a k x k square are one dilation by a square of
+#    radius R = n * (k // 2). It is computed on the bit-packed mask (see
+#    packed_mask.py) in log2(R) passes of 8 pixels per operation.
+#    -> Identical to cv.dilate.
+#
+# 2. GAUSSIAN BLUR : cascade of 3 box filters with the same variance as the
+#    OpenCV Gaussian kernel (constant cost per pixel).
+#    -> Within BLUR_TOLERANCE gray levels of cv.GaussianBlur.
+#
+# 3. ADAPTIVE THRESHOLD : same comparison as OpenCV, the Gaussian local mean
+#    being computed with the box cascade.
+#    -> Only pixels within a few gray levels of the threshold can change
+#       (less than THRESHOLD_TOLERANCE of the mask).
+#    16-bit and float32 images (cv.adaptiveThreshold only takes 8-bit ones)
+#    keep their precision : the local mean is computed in their own type and
+#    C, given in 8-bit gray levels, is scaled to their range.
+#
+# The box cascade and the dilation read at most ksize // 2 pixels around each
+# pixel, like the OpenCV functions they replace. Small kernels keep the exact
+# OpenCV functions, which are faster there (crossovers measured with the
+# benchmark below). The opening kernel is at most 21 pixels and stays in
+# OpenCV.
+#
+# Use : python fast_filters.py [FITS_FILE]  (benchmark over the slider ranges)
+
+import math
+import time
+
+import cv2 as cv
+import numpy as np
+
+from packed_mask import PackedMask
+from stretch import output_max
+
+# Kernel sizes from which the box cascade replaces OpenCV
+FAST_BLUR_MIN_KSIZE = 31
+FAST_THRESHOLD_MIN_BLOCK = 51
+# Dilation radius (pixels) from which the packed dilation replaces cv.dilate
+FAST_DILATE_MIN_RADIUS = 40
+
+# Documented tolerances (measured by the benchmark)
+BLUR_TOLERANCE = 8  # Max absolute difference (gray levels) with GaussianBlur
+THRESHOLD_TOLERANCE = 0.01  # Max fraction of mask pixels that differ
+
+
+def gaussian_sigma(ksize):
+    """Sigma used by OpenCV when GaussianBlur is called with sigma = 0."""
+    return 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+
+
+def box_sizes(sigma, passes=3):
+    """Odd box widths whose cascade has the variance of a Gaussian."""
+    ideal = math.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(ideal)
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    m = 12 * sigma * sigma - passes * lower * lower - 4 * passes * lower - 3 * passes
+    m = round(m / (-4 * lower - 4))
+    return [lower if i < m else upper for i in range(passes)]
+
+
+def box_cascade(image, ksize, border=cv.BORDER_DEFAULT):
+    """Gaussian approximation of an image by 3 box filters."""
+    result = image
+    for width in box_sizes(gaussian_sigma(ksize)):
+        result = cv.blur(result, (width, width), borderType=border)
+    return result
+
+
+def gaussian_blur(image, ksize):
+    """cv.GaussianBlur(image, (ksize, ksize), 0) with a constant cost."""
+    if ksize < FAST_BLUR_MIN_KSIZE:
+        return cv.GaussianBlur(image, (ksize, ksize), 0)
+    return box_cascade(image, ksize)
+
+
+def adaptive_threshold(gray, block_size, c_val):
+    """cv.adaptiveThreshold (GAUSSIAN_C, THRESH_BINARY, 255) with a constant cost."""
+    if gray.dtype != np.uint8:
+        return _adaptive_threshold_high_depth(gray, block_size, c_val)
+
+    if block_size < FAST_THRESHOLD_MIN_BLOCK:
+        return cv.adaptiveThreshold(
+            gray,
+            255,
+            cv.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv.THRESH_BINARY,
+            block_size,
+            c_val,
+        )
+
+    # Same as OpenCV : 8-bit local mean with replicated borders, then
+    # dst = 255 if src - mean > -ceil(C) else 0
+    mean = box_cascade(gray, block_size, cv.BORDER_REPLICATE | cv.BORDER_ISOLATED)
+    diff = cv.subtract(gray, mean, dtype=cv.CV_16S)
+    return cv.compare(diff, -math.ceil(c_val), cv.CMP_GT)
+
+
+def _adaptive_threshold_high_depth(gray, block_size, c_val):
+    """Same threshold for 16-bit and float32 images (C in 8-bit gray levels)."""
+    border = cv.BORDER_REPLICATE | cv.BORDER_ISOLATED
+    if block_size < FAST_THRESHOLD_MIN_BLOCK:
+        mean = cv.GaussianBlur(gray, (block_size, block_size), 0, borderType=border)
+    else:
+        mean = box_cascade(gray, block_size, border)
+    diff = cv.subtract(gray, mean, dtype=cv.CV_32F)
+    return cv.compare(diff, -c_val * output_max(gray.dtype) / 255, cv.CMP_GT)
+
+
+def dilate(mask, k_size, iterations):
+    """cv.dilate(mask, ones((k, k)), iterations=n) for a 0/255 mask."""
+    radius = iterations * (k_size // 2)
+    if radius < FAST_DILATE_MIN_RADIUS:
+        kernel = np.ones((k_size, k_size), np.uint8)
+        return cv.dilate(mask, kernel, iterations=iterations)
+
+    return PackedMask.from_array(mask).dilate(radius).to_array()
+
+
+def detect_stars(gray, block_size, c_val, k_opening):
+    """Adaptive threshold and opening : star cores, before any dilation."""
+    mask = adaptive_threshold(gray, block_size, c_val)
+    kernel_m = np.ones((k_opening, k_opening), np.uint8)
+    return cv.morphologyEx(mask, cv.MORPH_OPEN, kernel_m)
+
+
+def star_mask(gray, block_size, c_val, k_opening, iter_dilate):
+    """Adaptive threshold, opening and dilation (constant cost versions)."""
+    mask_cleaned = detect_stars(gray, block_size, c_val, k_opening)
+    return dilate(mask_cleaned, k_opening, iter_dilate)
+
+
+if __name__ == "__main__":
+    import sys
+
+    import star_pipeline
+
+    if len(sys.argv) > 1:
+        gray = star_pipeline.load_image(sys.argv[1])
+        if gray.ndim == 3:
+            gray = cv.cvtColor(gray, cv.COLOR_BGR2GRAY)
+    else:
+        # Synthetic 24 Mpx star field
+        rng = np.random.default_rng(0)
+        gray = rng.normal(40, 6, (4000, 6000)).clip(0, 255).astype(np.uint8)
+        ys, xs = rng.integers(0, 4000, 20000), rng.integers(0, 6000, 20000)
+        for r in (3, 2, 1):
+            for y, x in zip(ys, xs):
+                gray[max(y - r, 0) : y + r + 1, max(x - r, 0) : x + r + 1] += 30
+
+    def timed(func):
+        func()  # Warm-up
+        t0 = time.perf_counter()
+        result = func()
+        return result, (time.perf_counter() - t0) * 1000
+
+    print(f"Image : {gray.shape}, {cv.getNumThreads()} threads OpenCV\n")
+
+    print("Seuil adaptatif    OpenCV (ms)  rapide (ms)  pixels différents")
+    for block in (31, 51, 101, 151, 201, 251):
+        ref, t_ref = timed(
+            lambda: cv.adaptiveThreshold(
+                gray, 255, cv.ADAPTIVE_THRESH_GAUSSIAN_C, cv.THRESH_BINARY, block, -2
+            )
+        )
+        out, t_fast = timed(lambda: adaptive_threshold(gray, block, -2))
+        ratio = np.count_nonzero(ref != out) / ref.size
+        print(f"  bloc {block:<12} {t_ref:11.1f} {t_fast:12.1f}  {ratio:17.4%}")
+
+    mask = cv.morphologyEx(
+        adaptive_threshold(gray, 31, -2), cv.MORPH_OPEN, np.ones((3, 3), np.uint8)
+    )
+    print("\nDilatation         OpenCV (ms)  rapide (ms)  identique")
+    for k, n in ((3, 3), (3, 20), (7, 20), (9, 20), (15, 20), (21, 20)):
+        kernel = np.ones((k, k), np.uint8)
+        ref, t_ref = timed(lambda: cv.dilate(mask, kernel, iterations=n))
+        out, t_fast = timed(lambda: dilate(mask, k, n))
+        print(f"  k={k:<2} iter={n:<8} {t_ref:11.1f} {t_fast:12.1f}  {np.array_equal(ref, out)}")
+
+    mask = dilate(mask, 3, 3)
+    print("\nFlou gaussien      OpenCV (ms)  rapide (ms)  écart max")
+    for k in (15, 31, 51, 75, 101):
+        ref, t_ref = timed(lambda: cv.GaussianBlur(mask, (k, k), 0))
+        out, t_fast = timed(lambda: gaussian_blur(mask, k))
+        err = np.abs(ref.astype(np.int16) - out).max()
+        print(f"  noyau {k:<11} {t_ref:11.1f} {t_fast:12.1f}  {err:9d}")
@@ -0,0 +1,156 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Multi-image session of the real-time editor.
+#
+# A session holds a list of FITS files and the index of the displayed one. A
+# background thread keeps the current frame and its neighbours loaded and
+# normalized in a ring buffer of 2 * radius + 1 frames : moving to the next or
+# previous frame is served from memory while the thread loads the following
+# one. The session never waits for the thread : a frame that is not loaded yet
+# is None, and the thread calls ``on_ready`` each time it stores a frame (the
+# editor forwards it to the interface with a signal). A file that cannot be
+# read gives a frame carrying the error instead of an image.
+
+import os
+import threading
+from collections import OrderedDict
+
+import cv2 as cv
+
+import star_pipeline
+
+# Frames kept loaded on each side of the current one
+PREFETCH_RADIUS = 1
+
+
+class Frame:
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.raw_data = None
+        self.header = None
+        self.stretch_method = None
+        self.original_image = None
+        self.gray_image = None
+        self.error = None
+
+    def normalize(self, stretch_method):
+        """Normalization to [0, 255] for OpenCV, plus the grayscale version."""
+        image = star_pipeline.to_uint8_image(self.raw_data, stretch_method, self.header)
+        gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        self.original_image, self.gray_image = image, gray
+        self.stretch_method = stretch_method
+
+
+def load_frame(path, stretch_method="linear", frame=None):
+    """Reads and normalizes a FITS file (errors are stored in the frame).
+
+    An already loaded ``frame`` is only normalized again.
+    """
+    if frame is None or frame.raw_data is None:
+        frame = Frame(path)
+    try:
+        if frame.raw_data is None:
+            frame.raw_data, frame.header = star_pipeline.read_fits(path)
+        frame.normalize(stretch_method)
+    except Exception as e:
+        print(f"Error loading file: {e}")
+        frame.error = str(e)
+    return frame
+
+
+class FrameSession:
+    """List of frames with background prefetch of the neighbouring ones."""
+
+    def __init__(
+        self, paths, stretch_method="linear", radius=PREFETCH_RADIUS, on_ready=None
+    ):
+        self.paths = list(paths)
+        self.index = 0
+        self.radius = radius
+        self.stretch_method = stretch_method
+        # Called from the loader thread with each frame it stores
+        self.on_ready = on_ready
+        # Ring buffer : path -> Frame, least recently wanted first
+        self.frames = OrderedDict()
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def wanted(self):
+        """Paths to keep loaded, by priority (current, next, previous...)."""
+        indices = [self.index]
+        for offset in range(1, self.radius + 1):
+            indices += [self.index + offset, self.index - offset]
+        return [self.paths[i] for i in indices if 0 <= i < len(self.paths)]
+
+    def current(self):
+        """Current frame, None while the loader has not made it ready."""
+        with self.condition:
+            path = self.paths[self.index]
+            return self.frames[path] if self._ready(path) else None
+
+    def current_name(self):
+        return os.path.basename(self.paths[self.index])
+
+    def move(self, offset):
+        """Moves to another frame (clamped to the list), returns current()."""
+        with self.condition:
+            self.index = min(max(self.index + offset, 0), len(self.paths) - 1)
+            self.condition.notify_all()
+        return self.current()
+
+    def set_stretch(self, stretch_method):
+        """Loaded frames are normalized again in the background."""
+        with self.condition:
+            self.stretch_method = stretch_method
+            self.condition.notify_all()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+    def _ready(self, path):
+        frame = self.frames.get(path)
+        return frame is not None and (
+            frame.error is not None or frame.stretch_method == self.stretch_method
+        )
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and all(self._ready(p) for p in self.wanted()):
+                    self.condition.wait()
+                if not self.running:
+                    return
+                path = next(p for p in self.wanted() if not self._ready(p))
+                stretch_method = self.stretch_method
+                frame = self.frames.get(path)
+
+            # Read and normalized outside the lock
+            frame = load_frame(path, stretch_method, frame)
+
+            with self.condition:
+                self.frames[path] = frame
+                self.frames.move_to_end(path)
+                # Evict the frames that are no longer around the current one
+                wanted = self.wanted()
+                for old in [p for p in self.frames if p not in wanted]:
+                    if len(self.frames) <= 2 * self.radius + 1:
+                        break
+                    del self.frames[old]
+                self.condition.notify_all()
+
+            if self.on_ready is not None:
+                self.on_ready(frame)
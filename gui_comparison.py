@@ -7,8 +7,6 @@
 
 import cv2 as cv
 import numpy as np
-from astropy.io import fits
-from skimage.metrics import structural_similarity, mean_squared_error
 from PyQt6.QtWidgets import (
     QMainWindow,
     QWidget,
@@ -18,94 +16,120 @@ from PyQt6.QtWidgets import (
     QPushButton,
     QFileDialog,
     QMessageBox,
-    QDialog,
 )
-from PyQt6.QtCore import Qt, pyqtSignal
-from PyQt6.QtGui import QImage, QPixmap
+from PyQt6.QtCore import Qt, QRect, pyqtSignal
+from PyQt6.QtGui import QImage, QPainter, QPixmap
 
+from comparison_model import ComparisonModel
 
-# --- Model ---
-class ComparisonModel:
-    def __init__(self):
-        self.original_image = None
-        self.processed_image = None
-
-    def load_image(self, filepath):
-        """Updates the image from a file (FITS or standard format)."""
-        if filepath.lower().endswith((".fits", ".fit")):
-            try:
-                hdul = fits.open(filepath)
-                data = hdul[0].data
-                hdul.close()
-                if data.ndim == 3 and data.shape[0] == 3:
-                    data = np.transpose(data, (1, 2, 0))
-
-                # Normalization for display
-                img = ((data - data.min()) / (data.max() - data.min()) * 255).astype(
-                    "uint8"
-                )
-                if len(img.shape) == 3:
-                    img = cv.cvtColor(img, cv.COLOR_RGB2BGR)
-                return img
-            except Exception as e:
-                print(f"Error loading FITS: {e}")
-                return None
-        else:
-            return cv.imread(filepath)
-
-    def compute_difference(self):
-        """Calculates difference and applies a heatmap (Red=Max Diff, Blue=Min Diff)."""
-        if self.original_image is None or self.processed_image is None:
-            return None
-
-        h1, w1 = self.original_image.shape[:2]
-        img2 = cv.resize(self.processed_image, (w1, h1))  # Match size
 
-        # 1. Absolute difference
-        diff = cv.absdiff(self.original_image, img2)
-
-        # 2. Convert to grayscale (single intensity layer)
-        if len(diff.shape) == 3:
-            diff_gray = cv.cvtColor(diff, cv.COLOR_BGR2GRAY)
-        else:
-            diff_gray = diff
+# --- View ---
+def to_qimage(img):
+    """QImage sharing the buffer of a contiguous RGB or grayscale image."""
+    h, w = img.shape[:2]
+    if img.ndim == 3:
+        return QImage(img.data, w, h, img.strides[0], QImage.Format.Format_RGB888)
+    return QImage(img.data, w, h, img.strides[0], QImage.Format.Format_Grayscale8)
 
-        # 3. Min-Max Normalization to use the full color spectrum
-        # This allows visualizing relative differences like a weather map
-        diff_norm = cv.normalize(diff_gray, None, 0, 255, cv.NORM_MINMAX)
 
-        # 4. Apply JET Colormap (Blue=Cold/Low diff -> Red=Hot/High diff)
-        heatmap = cv.applyColorMap(diff_norm, cv.COLORMAP_JET)
+class TiledImageView(QWidget):
+    """Image pane drawn from a TilePyramid (wheel : zoom, drag : pan).
 
-        return heatmap
+    The view only draws the tiles of the visible area, from the pyramid level
+    matching the zoom. User actions emit view_changed instead of moving the
+    view, so that several panes can follow the same viewport.
+    """
 
-    def calculate_metrics(self):
-        """Calculates MSE and SSIM between the two images."""
-        if self.original_image is None or self.processed_image is None:
-            return None
+    # Center (x, y) in full resolution pixels, zoom (screen pixels per pixel)
+    view_changed = pyqtSignal(float, float, float)
+    reset_requested = pyqtSignal()
 
-        # Resize to match dimensions
-        h1, w1 = self.original_image.shape[:2]
-        img2 = cv.resize(self.processed_image, (w1, h1))
+    ZOOM_STEP = 1.25
+    MAX_ZOOM = 32.0
 
-        # Convert to grayscale for metrics (Standard practice for SSIM)
-        if len(self.original_image.shape) == 3:
-            gray1 = cv.cvtColor(self.original_image, cv.COLOR_BGR2GRAY)
-        else:
-            gray1 = self.original_image
+    def __init__(self, placeholder):
+        super().__init__()
+        self.placeholder = placeholder
+        self.pyramid = None
+        self.center = (0.0, 0.0)
+        self.zoom = None
+        self.drag_pos = None
+        self.setMinimumSize(200, 200)
+
+    def set_pyramid(self, pyramid):
+        self.pyramid = pyramid
+        self.update()
+
+    def set_view(self, cx, cy, zoom):
+        self.center = (cx, cy)
+        self.zoom = zoom
+        self.update()
+
+    def fit_zoom(self, width, height):
+        """Zoom showing a full image of the given size."""
+        return min(self.width() / width, self.height() / height)
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), Qt.GlobalColor.black)
+        if self.pyramid is None or self.zoom is None:
+            painter.setPen(Qt.GlobalColor.white)
+            painter.drawText(self.rect(), Qt.AlignmentFlag.AlignCenter, self.placeholder)
+            return
 
-        if len(img2.shape) == 3:
-            gray2 = cv.cvtColor(img2, cv.COLOR_BGR2GRAY)
-        else:
-            gray2 = img2
+        # Visible area (full resolution pixels)
+        zoom = self.zoom
+        x0 = self.center[0] - self.width() / (2 * zoom)
+        y0 = self.center[1] - self.height() / (2 * zoom)
+        x1 = x0 + self.width() / zoom
+        y1 = y0 + self.height() / zoom
+
+        # Magnified pixels stay sharp (star residuals), reductions are smoothed
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform, zoom < 1)
+        level = self.pyramid.level_for_zoom(zoom)
+        for tile, (x, y, w, h) in self.pyramid.visible_tiles(level, x0, y0, x1, y1):
+            # Rounding each edge the same way leaves no gap between tiles
+            left, top = round((x - x0) * zoom), round((y - y0) * zoom)
+            right, bottom = round((x + w - x0) * zoom), round((y + h - y0) * zoom)
+            target = QRect(left, top, right - left, bottom - top)
+            painter.drawImage(target, to_qimage(tile))
+
+    def wheelEvent(self, event):
+        # Panes without an image still receive the zoom of the others
+        if self.pyramid is None or self.zoom is None:
+            return
+        step = self.ZOOM_STEP if event.angleDelta().y() > 0 else 1 / self.ZOOM_STEP
+        zoom = min(self.zoom * step, self.MAX_ZOOM)
+        min_zoom = self.fit_zoom(self.pyramid.width, self.pyramid.height) / 2
+        zoom = max(zoom, min_zoom)
+
+        # Zoom around the cursor : the pixel under it does not move
+        pos = event.position()
+        dx, dy = pos.x() - self.width() / 2, pos.y() - self.height() / 2
+        px = self.center[0] + dx / self.zoom
+        py = self.center[1] + dy / self.zoom
+        self.view_changed.emit(px - dx / zoom, py - dy / zoom, zoom)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton:
+            self.drag_pos = event.position()
+
+    def mouseMoveEvent(self, event):
+        if self.drag_pos is None or self.pyramid is None or self.zoom is None:
+            return
+        delta = event.position() - self.drag_pos
+        self.drag_pos = event.position()
+        cx = self.center[0] - delta.x() / self.zoom
+        cy = self.center[1] - delta.y() / self.zoom
+        self.view_changed.emit(cx, cy, self.zoom)
 
-        mse = mean_squared_error(gray1, gray2)
-        ssim_val = structural_similarity(gray1, gray2, data_range=255)
+    def mouseReleaseEvent(self, event):
+        self.drag_pos = None
 
-        return mse, ssim_val
+    def mouseDoubleClickEvent(self, event):
+        self.reset_requested.emit()
 
 
-# --- View ---
 class ComparisonView(QMainWindow):
     return_to_launcher = pyqtSignal()
 
@@ -140,17 +164,19 @@ class ComparisonView(QMainWindow):
 
         main_layout.addLayout(controls_layout)
 
+        hint = QLabel(
+            "Molette : zoom | Glisser : déplacer | Double-clic : image entière"
+        )
+        hint.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        main_layout.addWidget(hint)
+
         # Images
         self.image_layout = QHBoxLayout()
 
         # Left Column (Original)
         self.col_orig = QVBoxLayout()
-        self.label_orig = QLabel("Image Originale")
-        self.label_orig.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.label_orig.setStyleSheet(
-            "border: 1px solid #ccc; background-color: black; color: white;"
-        )
-        self.col_orig.addWidget(self.label_orig)
+        self.view_orig = TiledImageView("Image Originale")
+        self.col_orig.addWidget(self.view_orig)
 
         self.lbl_metrics_orig = QLabel("Reference")
         self.lbl_metrics_orig.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -158,14 +184,10 @@ class ComparisonView(QMainWindow):
 
         self.image_layout.addLayout(self.col_orig)
 
-        # Right Column (Processed)
+        # Middle Column (Processed)
         self.col_proc = QVBoxLayout()
-        self.label_proc = QLabel("Image Modifiée")
-        self.label_proc.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.label_proc.setStyleSheet(
-            "border: 1px solid #ccc; background-color: black; color: white;"
-        )
-        self.col_proc.addWidget(self.label_proc)
+        self.view_proc = TiledImageView("Image Modifiée")
+        self.col_proc.addWidget(self.view_proc)
 
         self.lbl_metrics_proc = QLabel("Similitude: -")
         self.lbl_metrics_proc.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -173,8 +195,26 @@ class ComparisonView(QMainWindow):
 
         self.image_layout.addLayout(self.col_proc)
 
+        # Right Column (Heatmap + legend, hidden until requested)
+        self.heatmap_panel = QWidget()
+        heatmap_layout = QHBoxLayout(self.heatmap_panel)
+        heatmap_layout.setContentsMargins(0, 0, 0, 0)
+        self.view_diff = TiledImageView("Carte de Chaleur des Différences")
+        heatmap_layout.addWidget(self.view_diff)
+        self.lbl_legend = QLabel()
+        heatmap_layout.addWidget(self.lbl_legend)
+        self.heatmap_panel.hide()
+
+        self.image_layout.addWidget(self.heatmap_panel)
+
         main_layout.addLayout(self.image_layout)
 
+        # One viewport shared by the three panes
+        self.views = (self.view_orig, self.view_proc, self.view_diff)
+        for view in self.views:
+            view.view_changed.connect(self.sync_views)
+            view.reset_requested.connect(self.reset_view)
+
         # Bottom
         bottom_layout = QHBoxLayout()
         bottom_layout.addStretch()
@@ -194,7 +234,7 @@ class ComparisonView(QMainWindow):
         if filepath:
             img = self.model.load_image(filepath)
             if img is not None:
-                self.model.original_image = img
+                self.model.set_images(original=img)
                 self.update_display()
 
     def load_processed(self):
@@ -204,23 +244,32 @@ class ComparisonView(QMainWindow):
         if filepath:
             img = self.model.load_image(filepath)
             if img is not None:
-                self.model.processed_image = img
+                self.model.set_images(processed=img)
                 self.update_display()
 
     def show_difference(self):
-        diff = self.model.compute_difference()
-        if diff is not None:
-            # Add legend before display
-            diff_with_legend = self.add_heatmap_legend(diff)
-            self.show_popup_image(diff_with_legend, "Carte de Chaleur des Différences")
+        if self.heatmap_panel.isVisible():
+            self.heatmap_panel.hide()
+            self.btn_diff.setText("Voir les Différences")
+            return
+
+        heatmap = self.model.difference_tiles()
+        if heatmap is not None:
+            # Tiles are computed by the pane, for the visible area only
+            self.view_diff.set_pyramid(heatmap)
+            self.heatmap_panel.show()
+            self.btn_diff.setText("Masquer les Différences")
+            legend = self.heatmap_legend(self.view_orig.height())
+            self.lbl_legend.setPixmap(
+                QPixmap.fromImage(to_qimage(cv.cvtColor(legend, cv.COLOR_BGR2RGB)))
+            )
         else:
             QMessageBox.warning(
                 self, "Attention", "Veuillez charger les deux images d'abord."
             )
 
-    def add_heatmap_legend(self, heatmap):
-        """Adds a vertical legend bar to the right of the image."""
-        h, w = heatmap.shape[:2]
+    def heatmap_legend(self, h):
+        """Vertical legend bar of the heatmap colours."""
         legend_w = 50
 
         # 1. Create gradient (255 top -> 0 bottom) to match JET (Red -> Blue)
@@ -240,15 +289,15 @@ class ComparisonView(QMainWindow):
         cv.putText(legend_color, "Diff", (5, h // 2), font, scale, white, 1)
         cv.putText(legend_color, "Min", (5, h - 10), font, scale, white, 1)
 
-        # 4. Assembly : Image | Spacer | Legend
-        spacer = np.zeros((h, 10, 3), dtype=np.uint8)  # 10px black strip
-        combined = np.hstack((heatmap, spacer, legend_color))
-
-        return combined
+        return legend_color
 
     def update_display(self):
-        self.display_image(self.model.original_image, self.label_orig)
-        self.display_image(self.model.processed_image, self.label_proc)
+        self.view_orig.set_pyramid(self.model.original_tiles)
+        self.view_proc.set_pyramid(self.model.processed_tiles)
+        # A new image invalidates the heatmap
+        self.heatmap_panel.hide()
+        self.btn_diff.setText("Voir les Différences")
+        self.reset_view()
 
         # Calculate and display metrics
         metrics = self.model.calculate_metrics()
@@ -262,60 +311,17 @@ class ComparisonView(QMainWindow):
             self.lbl_metrics_orig.setText("Originale (Réf)")
             self.lbl_metrics_proc.setText("En attente de comparaison...")
 
-    def display_image(self, img, label):
-        if img is None:
-            label.setText("Pas d'image")
+    def reset_view(self):
+        """Shows the whole image in every pane."""
+        pyramid = self.model.original_tiles or self.model.processed_tiles
+        if pyramid is None:
             return
+        zoom = self.view_orig.fit_zoom(pyramid.width, pyramid.height)
+        self.sync_views(pyramid.width / 2, pyramid.height / 2, zoom)
 
-        # Resize for display efficiency
-        h, w = img.shape[:2]
-        max_h = 600
-        if h > max_h:
-            scale = max_h / h
-            img = cv.resize(img, (int(w * scale), int(h * scale)))
-
-        if len(img.shape) == 3:
-            rgb = cv.cvtColor(img, cv.COLOR_BGR2RGB)
-            h, w, c = rgb.shape
-            qimg = QImage(rgb.data, w, h, w * c, QImage.Format.Format_RGB888)
-        else:
-            h, w = img.shape
-            qimg = QImage(img.data, w, h, w, QImage.Format.Format_Grayscale8)
-
-        label.setPixmap(
-            QPixmap.fromImage(qimg).scaled(
-                label.size(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation,
-            )
-        )
-
-    def show_popup_image(self, img, title):
-        dlg = QDialog(self)
-        dlg.setWindowTitle(title)
-        dlg.resize(800, 600)
-        layout = QVBoxLayout(dlg)
-        lbl = QLabel()
-        lbl.setAlignment(Qt.AlignmentFlag.AlignCenter)
-
-        # Display logic similar to main labels
-        h, w = img.shape[:2]
-        max_h = 700
-        if h > max_h:
-            scale = max_h / h
-            img = cv.resize(img, (int(w * scale), int(h * scale)))
-
-        if len(img.shape) == 3:
-            rgb = cv.cvtColor(img, cv.COLOR_BGR2RGB)
-            h, w, c = rgb.shape
-            qimg = QImage(rgb.data, w, h, c * w, QImage.Format.Format_RGB888)
-        else:
-            h, w = img.shape
-            qimg = QImage(img.data, w, h, w, QImage.Format.Format_Grayscale8)
-
-        lbl.setPixmap(QPixmap.fromImage(qimg))
-        layout.addWidget(lbl)
-        dlg.show()
+    def sync_views(self, cx, cy, zoom):
+        for view in self.views:
+            view.set_view(cx, cy, zoom)
 
     def on_back_click(self):
         self.return_to_launcher.emit()
@@ -6,9 +6,9 @@
 # - PACE--BOULNOIS Lysandre (NovaChocolat)
 
 import sys
+import threading
 import cv2 as cv
 import numpy as np
-from astropy.io import fits
 from PyQt6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -20,126 +20,485 @@ from PyQt6.QtWidgets import (
     QGroupBox,
     QFileDialog,
     QPushButton,
+    QComboBox,
+    QRubberBand,
 )
-from PyQt6.QtCore import Qt, pyqtSignal, QTimer
-from PyQt6.QtGui import QImage, QPixmap
+from PyQt6.QtCore import Qt, pyqtSignal, QTimer, QThread, QRect, QSize
+from PyQt6.QtGui import QImage, QPixmap, QPainter, QPen, QColor, QKeySequence
+
+import fast_filters
+import star_pipeline
+import thread_policy
+from frame_session import FrameSession, load_frame
+from packed_mask import PackedMask
+from render_cache import DEFAULT_CACHE_BYTES, RenderCache, params_key
+from stretch import STRETCHES
+
+# Number of parameter sets kept for the previous/next navigation
+HISTORY_SIZE = 50
 
 
 # --- Model ---
 class StarModel:
-    def __init__(self):
+    def __init__(self, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.raw_data = None
+        self.header = None
+        # Path of the displayed frame (part of the cache keys)
+        self.frame_id = None
+        self.stretch_method = "linear"
         self.original_image = None
         self.gray_image = None
 
+        # Rendered results (keyed by the full parameter dict) and stage
+        # outputs (star mask, inpainting) share the memory limit
+        self.results = RenderCache(cache_bytes * 3 // 4)
+        self.stages = RenderCache(cache_bytes // 4)
+        # The image is processed in a background thread
+        self.lock = threading.Lock()
+
     def load_fits_data(self, filepath):
-        try:
-            # Open and read the FITS file
-            hdul = fits.open(filepath)
-            # Access the data from the primary HDU
-            data = hdul[0].data
-            hdul.close()
-
-            # Handle both monochrome and color images
-            if data.ndim == 3:
-                # Color image - need to transpose to (height, width, channels)
-                if data.shape[0] == 3:
-                    data = np.transpose(data, (1, 2, 0))
-
-                # Global normalization to [0, 255] for OpenCV
-                self.original_image = (
-                    (data - data.min()) / (data.max() - data.min()) * 255
-                ).astype("uint8")
-                # Conversion RGB to BGR for OpenCV
-                self.original_image = cv.cvtColor(self.original_image, cv.COLOR_RGB2BGR)
-            else:
-                # Convert to uint8 for OpenCV
-                self.original_image = (
-                    (data - data.min()) / (data.max() - data.min()) * 255
-                ).astype("uint8")
-
-            # Keep a grayscale version for mask calculation
-            if len(self.original_image.shape) == 3:
-                self.gray_image = cv.cvtColor(self.original_image, cv.COLOR_BGR2GRAY)
-            else:
-                self.gray_image = self.original_image
-
-        except Exception as e:
-            print(f"Error loading file: {e}")
-            sys.exit(1)
-
-    def process_image(self, params):
+        """Loads a FITS file, returns False (image unchanged) on error."""
+        # Open and read the FITS file (data and header of the primary HDU)
+        frame = load_frame(filepath, self.stretch_method)
+        if frame.error is not None:
+            return False
+        self.results.clear()
+        self.stages.clear()
+        self.set_frame(frame)
+        return True
+
+    def set_frame(self, frame):
+        """Displays a loaded frame (see frame_session.py).
+
+        Results of the other frames stay cached until evicted.
+        """
+        with self.lock:
+            stretch_method = self.stretch_method
+        if frame.stretch_method == stretch_method:
+            images = frame.original_image, frame.gray_image
+        else:
+            images = self.normalize(frame.raw_data, frame.header, stretch_method)
+        with self.lock:
+            self.frame_id = frame.path
+            self.raw_data, self.header = frame.raw_data, frame.header
+            self.original_image, self.gray_image = images
+
+    def set_stretch(self, stretch_method):
+        """Normalizes the frame again with another stretch.
+
+        The normalization runs outside the lock (a render holds it), then the
+        method and its images are replaced together : a render or a cache key
+        never mixes two stretches. Called by the render thread.
+        """
+        while True:
+            with self.lock:
+                raw_data, header = self.raw_data, self.header
+            images = None
+            if raw_data is not None:
+                images = self.normalize(raw_data, header, stretch_method)
+            with self.lock:
+                if self.raw_data is not raw_data:
+                    continue  # Another frame was set meanwhile
+                self.stretch_method = stretch_method
+                if images is not None:
+                    self.original_image, self.gray_image = images
+                return
+
+    @staticmethod
+    def normalize(raw_data, header, stretch_method):
+        """8-bit image (BGR for color images) and its grayscale version."""
+        # Normalization to [0, 255] for OpenCV
+        original_image = star_pipeline.to_uint8_image(raw_data, stretch_method, header)
+
+        # Keep a grayscale version for mask calculation
+        if len(original_image.shape) == 3:
+            gray_image = cv.cvtColor(original_image, cv.COLOR_BGR2GRAY)
+        else:
+            gray_image = original_image
+        return original_image, gray_image
+
+    def cache_key(self, params, roi=None):
+        return params_key(params, self.frame_id, self.stretch_method, roi)
+
+    def process_image(self, params, cancelled=None, roi=None):
+        """Processes the image, reusing cached results and stage outputs.
+
+        With a region of interest ``roi`` (x, y, w, h), only that region is
+        returned, computed from the smallest surrounding area giving the same
+        pixels as a full image processing.
+
+        ``cancelled`` is an optional callable checked between stages and
+        between the inpainting bands; the processing stops (and returns None)
+        as soon as it returns True.
+        """
         if self.original_image is None:
             return None
 
-        try:
-            # Extract Phase 3 parameters
-            block_size = params.get("thresh_block", 31)
-            c_val = params.get("thresh_c", -2)
-
-            k_opening = params.get("opening_kernel", 3)
-            iter_dilate = params.get("dilate_iter", 3)
-
-            inpaint_radius = params.get("inpaint_radius", 5)
-            # Alpha is a percentage (0-100) in the interface, convert to 0.0-1.0
-            alpha = params.get("reduction_alpha", 60) / 100.0
-
-            k_blur = params.get("blur_kernel", 15)
-
-            # 1. Star Mask Creation (Detection)
-            mask = cv.adaptiveThreshold(
-                self.gray_image,
-                255,
-                cv.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv.THRESH_BINARY,
-                block_size,
-                c_val,
-            )
+        with self.lock:
+            key = self.cache_key(params, roi)
+            cached = self.results.get(key)
+            if cached is not None:
+                return cached
+
+            try:
+                if roi is None:
+                    final_image = self._process_stages(params, cancelled)
+                else:
+                    final_image = self._process_roi(params, roi, cancelled)
+            except star_pipeline.Cancelled:
+                return None
+            except Exception as e:
+                print(f"Error in processing: {e}")
+                # Unprocessed pixels, of the requested area only
+                if roi is None:
+                    return self.original_image
+                x, y, w, h = roi
+                return self.original_image[y : y + h, x : x + w].copy()
+
+            if final_image is not None:
+                self.results.put(key, final_image)
+            return final_image
 
-            # 2. Mask Cleaning (Morphological Opening)
-            kernel_m = np.ones((k_opening, k_opening), np.uint8)
-            mask_cleaned = cv.morphologyEx(mask, cv.MORPH_OPEN, kernel_m)
+    @staticmethod
+    def _extract_params(params):
+        # Extract Phase 3 parameters
+        block_size = params.get("thresh_block", 31)
+        c_val = params.get("thresh_c", -2)
+
+        k_opening = params.get("opening_kernel", 3)
+        iter_dilate = params.get("dilate_iter", 3)
+
+        inpaint_radius = params.get("inpaint_radius", 5)
+        # Alpha is a percentage (0-100) in the interface, convert to 0.0-1.0
+        alpha = params.get("reduction_alpha", 60) / 100.0
+
+        k_blur = params.get("blur_kernel", 15)
+
+        mask_params = (block_size, c_val, k_opening, iter_dilate)
+        return mask_params, inpaint_radius, alpha, k_blur
+
+    @staticmethod
+    def _star_mask(gray, block_size, c_val, k_opening, iter_dilate):
+        # 1. Star Mask Creation (Detection)
+        # 2. Mask Cleaning (Morphological Opening)
+        # 3. Mask Expansion (Dilation to cover halos)
+        # Constant cost whatever the slider values (see fast_filters.py)
+        return fast_filters.star_mask(gray, block_size, c_val, k_opening, iter_dilate)
+
+    @staticmethod
+    def _fusion(original, inpainted_image, mask_dilated, alpha, k_blur):
+        # 5. Final Fusion (Alpha Blending)
+        # Soften mask edges for smooth transition
+        mask_blurred = fast_filters.gaussian_blur(mask_dilated, k_blur)
+
+        # Convert mask to float (0.0 - 1.0)
+        M = mask_blurred.astype(np.float32) / 255.0
+        if len(original.shape) == 3:
+            M = np.stack([M] * 3, axis=-1)
+
+        Ioriginal = original.astype(np.float32)
+        Iinpainted = inpainted_image.astype(np.float32)
+
+        # Phase 3 Fusion Formula:
+        # Weighted mix between original image and "repaired" (inpainted) image
+        final_image_float = (M * alpha * Iinpainted) + (1.0 - (M * alpha)) * Ioriginal
+
+        # Final conversion to uint8
+        return np.clip(final_image_float, 0, 255).astype(np.uint8)
+
+    def _process_stages(self, params, cancelled):
+        mask_params, inpaint_radius, alpha, k_blur = self._extract_params(params)
+
+        # Stage outputs only depend on their own and upstream parameters
+        mask_key = (self.frame_id, self.stretch_method) + mask_params
+        inpaint_key = mask_key + (inpaint_radius,)
+
+        # Masks are cached with one bit per pixel
+        packed_mask = self.stages.get(("mask", mask_key))
+        if packed_mask is None:
+            mask_dilated = self._star_mask(self.gray_image, *mask_params)
+            self.stages.put(("mask", mask_key), PackedMask.from_array(mask_dilated))
+        else:
+            mask_dilated = packed_mask.to_array()
 
-            # 3. Mask Expansion (Dilation to cover halos)
-            mask_dilated = cv.dilate(mask_cleaned, kernel_m, iterations=iter_dilate)
+        if cancelled is not None and cancelled():
+            return None
 
+        inpainted_image = self.stages.get(("inpaint", inpaint_key))
+        if inpainted_image is None:
             # 4. Inpainting (Smart reconstruction of masked areas using original image)
-            # Note: inpaint expects an 8-bit image
-            inpainted_image = cv.inpaint(
-                self.original_image, mask_dilated, inpaint_radius, cv.INPAINT_TELEA
+            # Note: inpaint expects an 8-bit image. Same result as cv.inpaint,
+            # by bands processed in parallel (and cancellable between them)
+            def check_cancelled(done, total):
+                if cancelled is not None and cancelled():
+                    raise star_pipeline.Cancelled("Traitement annulé")
+
+            inpainted_image = star_pipeline.inpaint(
+                self.original_image, mask_dilated, inpaint_radius, check_cancelled
             )
+            self.stages.put(("inpaint", inpaint_key), inpainted_image)
 
-            # 5. Final Fusion (Alpha Blending)
-            # Soften mask edges for smooth transition
-            mask_blurred = cv.GaussianBlur(mask_dilated, (k_blur, k_blur), 0)
+        if cancelled is not None and cancelled():
+            return None
 
-            # Convert mask to float (0.0 - 1.0)
-            M = mask_blurred.astype(np.float32) / 255.0
-            if len(self.original_image.shape) == 3:
-                M = np.stack([M] * 3, axis=-1)
+        return self._fusion(
+            self.original_image, inpainted_image, mask_dilated, alpha, k_blur
+        )
+
+    def _process_roi(self, params, roi, cancelled):
+        mask_params, inpaint_radius, alpha, k_blur = self._extract_params(params)
+        block_size, _, k_opening, iter_dilate = mask_params
+        height, width = self.gray_image.shape
+        x, y, w, h = roi
+
+        # Distance over which the mask stages read their input
+        mask_halo = block_size // 2 + (2 + iter_dilate) * (k_opening // 2)
+        # The fusion blurs the mask, the inpainting propagates inside the stars
+        reach = k_blur // 2 + inpaint_radius
+        grow_kernel = cv.getStructuringElement(
+            cv.MORPH_ELLIPSE, (2 * inpaint_radius + 1, 2 * inpaint_radius + 1)
+        )
+
+        while True:
+            # Area where the mask must be exact, and area read to compute it
+            area = _expand_box((x, y, x + w, y + h), reach, width, height)
+            crop = _expand_box(area, mask_halo, width, height)
+            ax0, ay0, ax1, ay1 = area
+            cx0, cy0, cx1, cy1 = crop
+
+            mask_crop = self._star_mask(self.gray_image[cy0:cy1, cx0:cx1], *mask_params)
+            mask_dilated = mask_crop[ay0 - cy0 : ay1 - cy0, ax0 - cx0 : ax1 - cx0]
+
+            # Stars closer than the inpainting radius influence each other :
+            # keep the groups of stars reaching the ROI, they must not be cut
+            # by the area border (unless it is the image border)
+            grown = cv.dilate(mask_dilated, grow_kernel)
+            _, labels = cv.connectedComponents(grown)
+            roi_labels = np.unique(labels[y - ay0 : y - ay0 + h, x - ax0 : x - ax0 + w])
+            roi_labels = roi_labels[roi_labels != 0]
+
+            edges = []
+            if ax0 > 0:
+                edges.append(labels[:, 0])
+            if ax1 < width:
+                edges.append(labels[:, -1])
+            if ay0 > 0:
+                edges.append(labels[0, :])
+            if ay1 < height:
+                edges.append(labels[-1, :])
+            if not edges or not np.isin(roi_labels, np.concatenate(edges)).any():
+                break
+            reach *= 2
+
+            if cancelled is not None and cancelled():
+                return None
+
+        if cancelled is not None and cancelled():
+            return None
 
-            Ioriginal = self.original_image.astype(np.float32)
-            Iinpainted = inpainted_image.astype(np.float32)
+        # 4. Inpainting, restricted to the stars reaching the ROI
+        inpaint_mask = np.where(np.isin(labels, roi_labels), mask_dilated, 0)
+        original = self.original_image[ay0:ay1, ax0:ax1]
+        inpainted_image = cv.inpaint(
+            original, inpaint_mask.astype(np.uint8), inpaint_radius, cv.INPAINT_TELEA
+        )
 
-            # Phase 3 Fusion Formula:
-            # Weighted mix between original image and "repaired" (inpainted) image
-            final_image_float = (M * alpha * Iinpainted) + (
-                1.0 - (M * alpha)
-            ) * Ioriginal
+        if cancelled is not None and cancelled():
+            return None
 
-            # Final conversion to uint8
-            final_image = np.clip(final_image_float, 0, 255).astype(np.uint8)
+        final_area = self._fusion(original, inpainted_image, mask_dilated, alpha, k_blur)
+        return final_area[y - ay0 : y - ay0 + h, x - ax0 : x - ax0 + w]
 
-            return final_image
-        except Exception as e:
-            print(f"Error in processing: {e}")
-            return self.original_image
+
+def _expand_box(box, margin, width, height):
+    """Grows (x0, y0, x1, y1) by margin, clipped to the image."""
+    x0, y0, x1, y1 = box
+    return (
+        max(x0 - margin, 0),
+        max(y0 - margin, 0),
+        min(x1 + margin, width),
+        min(y1 + margin, height),
+    )
+
+
+# --- Worker ---
+class RenderWorker(QThread):
+    """Background processing thread of the real-time editor.
+
+    Requested renders are processed first. When idle, the worker renders the
+    neighbouring values of the last moved slider so that nudging it back and
+    forth is served from the cache. Frame switches are applied by this thread
+    too, between two renders, so that the interface never waits for the model.
+    """
+
+    # Carries the result, its region of interest (None for the full image)
+    # and the path of its frame
+    result_ready = pyqtSignal(object, object, object)
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.condition = threading.Condition()
+        self.pending = None
+        self.speculative = []
+        self.frame = None
+        self.stretch_method = None
+        # Incremented whenever the speculative renders become obsolete
+        self.generation = 0
+        self.running = True
+
+    def request(self, params, speculative=(), roi=None):
+        with self.condition:
+            self.pending = (params, roi)
+            self.speculative = [(p, roi) for p in speculative]
+            self.generation += 1
+            self.condition.notify()
+
+    def set_frame(self, frame):
+        """Switches to another frame before the next render."""
+        with self.condition:
+            self.frame = frame
+            self.speculative = []
+            self.generation += 1
+            self.condition.notify()
+
+    def set_stretch(self, stretch_method):
+        """Normalizes the image again before the next render."""
+        with self.condition:
+            self.stretch_method = stretch_method
+            self.speculative = []
+            self.generation += 1
+            self.condition.notify()
+
+    def cancel_speculation(self):
+        with self.condition:
+            self.speculative = []
+            self.generation += 1
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.generation += 1
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and self.pending is None and not self.speculative:
+                    self.condition.wait()
+                if not self.running:
+                    return
+
+                frame, self.frame = self.frame, None
+                stretch_method, self.stretch_method = self.stretch_method, None
+                if self.pending is not None:
+                    (params, roi), self.pending = self.pending, None
+                    # A newer request, another frame or another stretch makes
+                    # this one obsolete
+                    cancelled = lambda: (
+                        self.pending is not None
+                        or self.frame is not None
+                        or self.stretch_method is not None
+                        or not self.running
+                    )
+                    speculative = False
+                else:
+                    params, roi = self.speculative.pop(0)
+                    generation = self.generation
+                    cancelled = lambda: self.generation != generation
+                    speculative = True
+
+            if frame is not None:
+                self.model.set_frame(frame)
+            if stretch_method is not None:
+                self.model.set_stretch(stretch_method)
+            result = self.model.process_image(params, cancelled, roi)
+            if result is not None and not speculative:
+                self.result_ready.emit(result, roi, self.model.frame_id)
 
 
 # --- View ---
+class RoiLabel(QLabel):
+    """Image display where a region of interest is drawn with the left mouse
+    button (right click clears it)."""
+
+    # Carries (x, y, w, h) in image pixels, or None when cleared
+    roi_selected = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.image_size = None
+        self.origin = None
+        self.rubber_band = QRubberBand(QRubberBand.Shape.Rectangle, self)
+
+    def pixmap_rect(self):
+        # The pixmap is centered in the label
+        pixmap = self.pixmap()
+        if pixmap is None or pixmap.isNull():
+            return None
+        x = (self.width() - pixmap.width()) // 2
+        y = (self.height() - pixmap.height()) // 2
+        return QRect(x, y, pixmap.width(), pixmap.height())
+
+    def to_image(self, point, rect):
+        w, h = self.image_size
+        x = (point.x() - rect.x()) * w / rect.width()
+        y = (point.y() - rect.y()) * h / rect.height()
+        return min(max(int(x), 0), w), min(max(int(y), 0), h)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.RightButton:
+            self.roi_selected.emit(None)
+        elif self.image_size is not None and self.pixmap_rect() is not None:
+            self.origin = event.position().toPoint()
+            self.rubber_band.setGeometry(QRect(self.origin, QSize()))
+            self.rubber_band.show()
+
+    def mouseMoveEvent(self, event):
+        if self.origin is not None:
+            current = event.position().toPoint()
+            self.rubber_band.setGeometry(QRect(self.origin, current).normalized())
+
+    def mouseReleaseEvent(self, event):
+        if self.origin is None:
+            return
+        self.rubber_band.hide()
+        selection = QRect(self.origin, event.position().toPoint()).normalized()
+        self.origin = None
+
+        rect = self.pixmap_rect()
+        x0, y0 = self.to_image(selection.topLeft(), rect)
+        x1, y1 = self.to_image(selection.bottomRight(), rect)
+        # Ignore simple clicks
+        if x1 - x0 >= 8 and y1 - y0 >= 8:
+            self.roi_selected.emit((x0, y0, x1 - x0, y1 - y0))
+
+
 class StarView(QMainWindow):
     # Signal emitted when any parameter changes
     # Carries a dictionary of all current parameter values
     parameters_changed = pyqtSignal(dict)
+    # Signal emitted when the normalization (stretch) is changed
+    stretch_changed = pyqtSignal(str)
+    # Signal emitted as soon as the user touches a slider (before debounce)
+    user_input = pyqtSignal()
+    # Signal emitted to move in the settings history (-1 previous, +1 next)
+    history_requested = pyqtSignal(int)
+    # Signal emitted when a region of interest is drawn (None when cleared)
+    roi_changed = pyqtSignal(object)
+    # Signal emitted to process the whole image while a ROI is active
+    full_render_requested = pyqtSignal()
+    # Signal emitted to save the full resolution result
+    export_requested = pyqtSignal()
+    # Signal emitted to move in the session frames (-1 previous, +1 next)
+    frame_requested = pyqtSignal(int)
+    # Signal emitted to open another list of FITS files
+    open_requested = pyqtSignal()
+    # Signal emitted (from the loader thread of the session) when a frame is loaded
+    frame_loaded = pyqtSignal(object)
+    # Signal emitted when the window is closed
+    window_closed = pyqtSignal()
     # Signal emitted when returning to launcher
     return_to_launcher = pyqtSignal()
 
@@ -153,8 +512,10 @@ class StarView(QMainWindow):
         self.setCentralWidget(self.central_widget)
         self.main_layout = QHBoxLayout(self.central_widget)
 
-        # Image display area
-        self.image_label = QLabel()
+        # Image display area (a region of interest can be drawn on it)
+        self.roi = None
+        self.image_label = RoiLabel()
+        self.image_label.roi_selected.connect(self.set_roi)
         self.image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.image_label.setMinimumSize(800, 600)
         self.image_label.setStyleSheet(
@@ -180,6 +541,30 @@ class StarView(QMainWindow):
 
     # Create sliders and labels for parameters
     def create_controls(self):
+        # Session frames (the neighbouring ones are loaded in the background)
+        self.frame_info = QLabel("Aucune image")
+        self.controls_layout.addWidget(self.frame_info)
+        frames_layout = QHBoxLayout()
+        self.btn_previous_frame = QPushButton("◀ Image précédente")
+        self.btn_previous_frame.setShortcut(QKeySequence(Qt.Key.Key_PageUp))
+        self.btn_previous_frame.clicked.connect(lambda: self.frame_requested.emit(-1))
+        frames_layout.addWidget(self.btn_previous_frame)
+        self.btn_next_frame = QPushButton("Image suivante ▶")
+        self.btn_next_frame.setShortcut(QKeySequence(Qt.Key.Key_PageDown))
+        self.btn_next_frame.clicked.connect(lambda: self.frame_requested.emit(1))
+        frames_layout.addWidget(self.btn_next_frame)
+        self.controls_layout.addLayout(frames_layout)
+        self.btn_open = QPushButton("Ouvrir des images...")
+        self.btn_open.clicked.connect(self.open_requested.emit)
+        self.controls_layout.addWidget(self.btn_open)
+
+        # 0. Normalization (Stretch)
+        self.controls_layout.addWidget(QLabel("Étirement (normalisation)"))
+        self.stretch_combo = QComboBox()
+        self.stretch_combo.addItems(STRETCHES)
+        self.stretch_combo.currentTextChanged.connect(self.stretch_changed.emit)
+        self.controls_layout.addWidget(self.stretch_combo)
+
         # 1. Detection (Mask)
         self.add_control("Masque: Seuil Bloc (impair)", 3, 251, 31, 2, "thresh_block")
         self.add_control("Masque: Constante C", -50, 50, -2, 1, "thresh_c")
@@ -199,6 +584,32 @@ class StarView(QMainWindow):
 
         self.controls_layout.addStretch()
 
+        # Settings history (served from the cache)
+        history_layout = QHBoxLayout()
+        self.btn_previous = QPushButton("◀ Réglage précédent")
+        self.btn_previous.clicked.connect(lambda: self.history_requested.emit(-1))
+        history_layout.addWidget(self.btn_previous)
+        self.btn_next = QPushButton("Réglage suivant ▶")
+        self.btn_next.clicked.connect(lambda: self.history_requested.emit(1))
+        history_layout.addWidget(self.btn_next)
+        self.controls_layout.addLayout(history_layout)
+
+        # Region of interest (live processing of the drawn area only)
+        self.roi_info = QLabel("Zone d'intérêt : image entière")
+        self.controls_layout.addWidget(self.roi_info)
+        roi_layout = QHBoxLayout()
+        self.btn_clear_roi = QPushButton("Effacer la zone")
+        self.btn_clear_roi.clicked.connect(lambda: self.set_roi(None))
+        roi_layout.addWidget(self.btn_clear_roi)
+        self.btn_full_render = QPushButton("Traiter l'image entière")
+        self.btn_full_render.clicked.connect(self.full_render_requested.emit)
+        roi_layout.addWidget(self.btn_full_render)
+        self.controls_layout.addLayout(roi_layout)
+
+        self.btn_export = QPushButton("Exporter le résultat")
+        self.btn_export.clicked.connect(self.export_requested.emit)
+        self.controls_layout.addWidget(self.btn_export)
+
         # Back button
         self.btn_back = QPushButton("Retour au menu")
         self.btn_back.setStyleSheet(
@@ -243,11 +654,43 @@ class StarView(QMainWindow):
         # Update label text
         label_widget, base_text = self.labels[key]
         label_widget.setText(f"{base_text}: {value}")
+        self.user_input.emit()
 
         # Restart processing timer (Debounce)
         # Only process when user stops moving slider for 200ms
         self.update_timer.start()
 
+    def set_parameters(self, params):
+        # Move the sliders without triggering a new processing
+        for key, value in params.items():
+            self.sliders[key].blockSignals(True)
+            self.sliders[key].setValue(value)
+            self.sliders[key].blockSignals(False)
+            label_widget, base_text = self.labels[key]
+            label_widget.setText(f"{base_text}: {value}")
+
+    def set_frame_info(self, index, count, name):
+        self.frame_info.setText(f"Image {index + 1}/{count} : {name}")
+        self.btn_previous_frame.setEnabled(index > 0)
+        self.btn_next_frame.setEnabled(index < count - 1)
+
+    def show_message(self, text):
+        self.image_label.image_size = None
+        self.image_label.setText(text)
+
+    def set_roi(self, roi):
+        self.roi = roi
+        if roi is None:
+            self.roi_info.setText("Zone d'intérêt : image entière")
+        else:
+            x, y, w, h = roi
+            self.roi_info.setText(f"Zone d'intérêt : {w}x{h} en ({x}, {y})")
+        self.roi_changed.emit(roi)
+
+    def closeEvent(self, event):
+        self.window_closed.emit()
+        super().closeEvent(event)
+
     def emit_parameters(self):
         params = {key: slider.value() for key, slider in self.sliders.items()}
         self.parameters_changed.emit(params)
@@ -271,52 +714,251 @@ class StarView(QMainWindow):
                 img.data, w, h, bytes_per_line, QImage.Format.Format_Grayscale8
             )
 
-        pixmap = QPixmap.fromImage(qt_image)
-        self.image_label.setPixmap(
-            pixmap.scaled(
-                self.image_label.size(),
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation,
-            )
+        pixmap = QPixmap.fromImage(qt_image).scaled(
+            self.image_label.size(),
+            Qt.AspectRatioMode.KeepAspectRatio,
+            Qt.TransformationMode.SmoothTransformation,
         )
 
+        # Outline of the region of interest
+        if self.roi is not None:
+            scale = pixmap.width() / w
+            x, y, roi_w, roi_h = (int(v * scale) for v in self.roi)
+            painter = QPainter(pixmap)
+            painter.setPen(QPen(QColor("yellow"), 1, Qt.PenStyle.DashLine))
+            painter.drawRect(x, y, roi_w, roi_h)
+            painter.end()
+
+        self.image_label.image_size = (w, h)
+        self.image_label.setPixmap(pixmap)
+
 
 # --- Controller ---
 class StarController:
     def __init__(self, model, view):
         self.model = model
         self.view = view
+        self.last_params = None
+        self.history = []
+        self.history_index = -1
+        # Region of interest, last full resolution result and displayed image
+        self.roi = None
+        self.full_image = None
+        self.preview = None
+        # Opened files and displayed frame
+        self.session = None
+        self.frame = None
+
+        # Normalization of the opened frames (applied to the model by the worker)
+        self.stretch_method = self.model.stretch_method
+
+        # Background processing
+        self.worker = RenderWorker(self.model)
+        self.worker.result_ready.connect(self.show_result)
+        self.worker.start()
 
         # Connect View signals
         self.view.parameters_changed.connect(self.update_model)
+        self.view.stretch_changed.connect(self.update_stretch)
+        self.view.user_input.connect(self.worker.cancel_speculation)
+        self.view.history_requested.connect(self.navigate_history)
+        self.view.roi_changed.connect(self.update_roi)
+        self.view.full_render_requested.connect(self.render_full)
+        self.view.export_requested.connect(self.export_result)
+        self.view.frame_requested.connect(self.navigate_frame)
+        self.view.open_requested.connect(self.load_image)
+        self.view.frame_loaded.connect(self.frame_ready)
+        self.view.window_closed.connect(self.worker.stop)
+        self.view.window_closed.connect(self.close_session)
 
         # Initial load
         self.load_image()
 
     def load_image(self):
-        filepath, _ = QFileDialog.getOpenFileName(
+        filepaths, _ = QFileDialog.getOpenFileNames(
             self.view,
-            "Ouvrir une image FITS",
+            "Ouvrir des images FITS",
             "./examples",
             "FITS Files (*.fits *.fit)",
         )
 
-        if filepath:
-            self.model.load_fits_data(filepath)
+        if filepaths:
+            self.close_session()
+            self.session = FrameSession(
+                filepaths, self.stretch_method, on_ready=self.view.frame_loaded.emit
+            )
+            self.view.set_roi(None)
+            self.show_frame(self.session.current())
+        elif self.session is None:
+            # User canceled, close app
+            self.worker.stop()
+            sys.exit(0)
+
+    def close_session(self):
+        if self.session is not None:
+            self.session.stop()
+            self.session = None
+
+    def navigate_frame(self, offset):
+        if self.session is not None:
+            self.show_frame(self.session.move(offset))
+
+    def frame_ready(self, frame):
+        # Frame waited for by show_frame(None), if it is the current one
+        if self.session is not None and self.frame is None:
+            current = self.session.current()
+            if current is not None:
+                self.show_frame(current)
+
+    def show_frame(self, frame):
+        """Displays a frame at once, then processes it with the current settings.
+
+        None (frame not loaded yet) shows a message until frame_ready.
+        """
+        self.frame = frame
+        self.full_image = None
+        name = self.session.current_name()
+        self.view.set_frame_info(self.session.index, len(self.session), name)
+        if frame is None:
+            self.worker.cancel_speculation()
+            self.view.show_message(f"Chargement de {name}...")
+            return
+        if frame.error is not None:
+            # A bad file is reported, the other frames stay available
+            self.worker.cancel_speculation()
+            self.view.show_message(f"Impossible de lire {frame.name} :\n{frame.error}")
+            return
+
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            height, width = frame.gray_image.shape
+            if x + w > width or y + h > height:
+                self.view.set_roi(None)
+        if self.roi is not None:
+            self.preview = frame.original_image.copy()
+        self.view.display_image(frame.original_image)
+
+        self.worker.set_frame(frame)
+        if self.last_params is None:
             # Trigger initial update
             self.view.emit_parameters()
         else:
-            # User canceled, close app
-            sys.exit(0)
+            self.worker.request(self.last_params, roi=self.roi)
+
+    def can_render(self):
+        return self.frame is not None and self.frame.error is None
+
+    def update_stretch(self, stretch_method):
+        # Normalized again by the worker, the interface does not wait
+        self.stretch_method = stretch_method
+        if self.session is not None:
+            self.session.set_stretch(stretch_method)
+        self.worker.set_stretch(stretch_method)
+        self.view.emit_parameters()
+
+    def neighbour_params(self, params, key):
+        """Parameter sets one slider step below and above for ``key``."""
+        slider = self.view.sliders[key]
+        step = slider.singleStep()
+        neighbours = []
+        for value in (params[key] + step, params[key] - step):
+            if slider.minimum() <= value <= slider.maximum():
+                neighbours.append(dict(params, **{key: value}))
+        return neighbours
 
     def update_model(self, params):
-        # Process image with new params
-        result_image = self.model.process_image(params)
-        # Update View
-        self.view.display_image(result_image)
+        # Prefetch around the slider that was just moved
+        speculative = []
+        if self.last_params is not None:
+            moved = [k for k in params if params[k] != self.last_params.get(k)]
+            if moved:
+                speculative = self.neighbour_params(params, moved[0])
+        self.last_params = params
+
+        if not self.history or self.history[self.history_index] != params:
+            del self.history[self.history_index + 1 :]
+            self.history.append(params)
+            del self.history[:-HISTORY_SIZE]
+            self.history_index = len(self.history) - 1
+
+        # Process image with new params (the result updates the View)
+        if self.can_render():
+            self.worker.request(params, speculative, self.roi)
+
+    def navigate_history(self, offset):
+        index = self.history_index + offset
+        if not 0 <= index < len(self.history):
+            return
+        self.history_index = index
+        params = self.history[index]
+        self.last_params = params
+        self.view.set_parameters(params)
+        if self.can_render():
+            self.worker.request(params, roi=self.roi)
+
+    def update_roi(self, roi):
+        self.roi = roi
+        if not self.can_render():
+            return
+        if roi is not None:
+            # Outside the ROI, show the last full result (or the original)
+            base = self.full_image
+            if base is None:
+                base = self.frame.original_image
+            self.preview = base.copy()
+        if self.last_params is not None:
+            self.worker.request(self.last_params, roi=roi)
+
+    def render_full(self):
+        if self.last_params is not None and self.can_render():
+            self.worker.request(self.last_params)
+
+    def show_result(self, image, roi, frame_id):
+        if self.frame is None or frame_id != self.frame.path:
+            return  # Result of a frame that is no longer displayed
+        if roi is None:
+            self.full_image = image
+            if self.roi is not None:
+                # Full image processed on demand : it becomes the background
+                self.preview = image.copy()
+                return self.view.display_image(self.preview)
+            return self.view.display_image(image)
+
+        if roi != self.roi:
+            return  # Result of a region that is no longer selected
+        x, y, w, h = roi
+        if image.shape[:2] != (h, w) or self.preview is None:
+            return  # Region not fully inside the image
+        self.preview[y : y + h, x : x + w] = image
+        self.view.display_image(self.preview)
+
+    def export_result(self):
+        if self.last_params is None or not self.can_render():
+            return
+        filepath, _ = QFileDialog.getSaveFileName(
+            self.view, "Exporter le résultat", "./results", "Images (*.png *.tif)"
+        )
+        if not filepath:
+            return
+
+        # The export always uses the full resolution image
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            if self.model.frame_id != self.frame.path:
+                # Frame switch not applied by the worker yet
+                self.model.set_frame(self.frame)
+            if self.model.stretch_method != self.stretch_method:
+                # Same for a stretch change
+                self.model.set_stretch(self.stretch_method)
+            image = self.model.process_image(self.last_params)
+            cv.imwrite(filepath, image)
+        finally:
+            QApplication.restoreOverrideCursor()
 
 
 if __name__ == "__main__":
+    # One image at a time : OpenCV and the inpainting bands use every core
+    thread_policy.apply(thread_policy.plan("interactive"))
     app = QApplication(sys.argv)
 
     model = StarModel()
@@ -0,0 +1,472 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Local HTTP job server for the star reduction.
+#
+# Jobs are queued onto a pool of worker processes that have already imported
+# OpenCV/Astropy and run the pipeline once, so a job only pays for its own
+# computation.
+#
+# Endpoints :
+#   POST /jobs             JSON {"path": ..., "params": {...}, "wait": false}
+#                          (params checked against PARAM_LIMITS, 400 if not)
+#                          or raw FITS bytes (params as query string, e.g.
+#                          /jobs?thresh_c=-4&wait=1). Optional "stretch" :
+#                          linear, percentile, asinh or midtone (stretch.py).
+#                          Optional "dtype" : uint8, uint16 or float32
+#                          (working type, see star_pipeline.py). Optional
+#                          "output_dir" : directory (relative to --output-root,
+#                          refused without it) where the results are also
+#                          written
+#   GET  /jobs/<id>        Job status, progress, timings and result names
+#   GET  /jobs/<id>/<name> Result image as PNG (mask, eroded, final), 16-bit
+#                          above 8 bits
+#   DELETE /jobs/<id>      Cancels a queued or running job
+#   GET  /metrics          Queue depth, per-stage latency histograms, throughput
+#
+# Use : python job_server.py [--host 127.0.0.1] [--port 8765] [--workers N]
+#                            [--output-root DIR]
+
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+import packed_mask
+import star_pipeline
+import thread_policy
+from stretch import STRETCHES
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Window (seconds) used to compute the throughput
+THROUGHPUT_WINDOW = 60.0
+# Finished jobs kept in memory before the oldest ones are dropped
+MAX_FINISHED_JOBS = 256
+
+
+# --- Worker side ---
+def _warm_worker(threads):
+    """Pool initializer: pays the imports and OpenCV first-call cost once."""
+    thread_policy.init_worker(threads)
+    dummy = np.zeros((64, 64), np.uint8)
+    dummy[30:34, 30:34] = 255
+    star_pipeline.reduce_stars(dummy)
+
+
+def _run_job(
+    source, params, output_dir, stretch_method, dtype, cancel_event, progress
+):
+    """Executed in a worker process. Returns encoded PNGs and stage timings.
+
+    ``cancel_event`` and ``progress`` (a dict) are shared with the server.
+    Above 8 bits, the final image is also written to ``output_dir`` as a
+    float32 FITS file.
+    """
+    cancel = star_pipeline.CancelToken(cancel_event)
+    cancel.check()
+
+    def report(stage, done, total):
+        progress.update(
+            stage=stage, fraction=star_pipeline.overall_progress(stage, done, total)
+        )
+
+    timings = {}
+    t0 = time.perf_counter()
+    image = star_pipeline.load_image(source, stretch_method, dtype)
+    timings["load"] = time.perf_counter() - t0
+
+    results = star_pipeline.reduce_stars(image, params, timings, report, cancel)
+
+    t1 = time.perf_counter()
+    encoded = {}
+    for name, img in results.items():
+        if name == "mask":
+            # 1 bit per pixel
+            encoded[name] = packed_mask.imencode(img)
+        else:
+            encoded[name] = star_pipeline.encode_image(img)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            with open(os.path.join(output_dir, f"{name}.png"), "wb") as f:
+                f.write(encoded[name])
+    if output_dir and image.dtype != np.uint8:
+        final_path = os.path.join(output_dir, "final.fits")
+        star_pipeline.save_image(final_path, results["final"])
+    timings["encode"] = time.perf_counter() - t1
+
+    return encoded, timings
+
+
+# --- Metrics ---
+class Histogram:
+    """Cumulative latency histogram (Prometheus-like buckets)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": self.total}
+
+
+class Job:
+    def __init__(self, params, stretch_method, dtype="uint8"):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.stretch = stretch_method
+        self.dtype = dtype
+        self.status = "queued"
+        self.error = None
+        self.results = {}
+        self.timings = {}
+        self.submitted = time.time()
+        self.finished = None
+        self.done = threading.Event()
+        # Shared with the worker process (see JobServer.submit)
+        self.cancel_event = None
+        self.progress = {}
+        self.future = None
+
+    def to_dict(self):
+        progress = dict(self.progress) if not self.done.is_set() else {}
+        status = self.status
+        if status == "queued" and progress.get("stage"):
+            status = "running"
+        elif status == "done":
+            progress = {"stage": None, "fraction": 1.0}
+        return {
+            "job_id": self.id,
+            "status": status,
+            "error": self.error,
+            "progress": progress,
+            "params": self.params,
+            "stretch": self.stretch,
+            "dtype": self.dtype,
+            "timings": self.timings,
+            "results": sorted(self.results),
+        }
+
+
+# --- Server ---
+class JobServer:
+    """Owns the worker pool, the job table and the metrics."""
+
+    def __init__(self, host="127.0.0.1", port=8765, workers=None, output_root=None):
+        # Cores split between the workers (see thread_policy.py)
+        self.plan = thread_policy.plan("batch", workers=workers)
+        self.workers = self.plan.workers
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_warm_worker,
+            initargs=(self.plan.threads,),
+        )
+        # Submitting no-ops forces every worker to start and warm up now
+        for _ in range(self.workers):
+            self.pool.submit(int)
+        # Only directory where jobs may write their results (None : nowhere)
+        self.output_root = output_root and os.path.realpath(output_root)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        # Cancellation events and progress shared with the worker processes
+        self.manager = multiprocessing.Manager()
+        self.finish_times = deque()
+        self.histograms = {}
+        self.started = time.time()
+
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.job_server = self
+        self.thread = None
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serves in a background thread (useful for tests and embedding)."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.stop()
+
+    def stop(self):
+        if self.thread is not None:
+            self.httpd.shutdown()
+        self.httpd.server_close()
+        for job in list(self.jobs.values()):
+            if not job.done.is_set():
+                job.cancel_event.set()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.manager.shutdown()
+
+    def output_path(self, output_dir):
+        """Directory of output_root named by a request (ValueError outside)."""
+        if self.output_root is None:
+            raise ValueError("Écriture des résultats désactivée (--output-root)")
+        path = os.path.realpath(os.path.join(self.output_root, output_dir))
+        if os.path.commonpath([path, self.output_root]) != self.output_root:
+            raise ValueError(f"Dossier de sortie hors de {self.output_root}")
+        return path
+
+    def submit(
+        self, source, params=None, output_dir=None, stretch_method="linear", dtype="uint8"
+    ):
+        params = star_pipeline.merge_params(params)
+        job = Job(params, stretch_method, dtype)
+        job.cancel_event = self.manager.Event()
+        job.progress = self.manager.dict(stage=None, fraction=0.0)
+        with self.lock:
+            self.jobs[job.id] = job
+            self.in_flight += 1
+            self._forget_old_jobs()
+
+        job.future = self.pool.submit(
+            _run_job,
+            source,
+            params,
+            output_dir,
+            stretch_method,
+            dtype,
+            job.cancel_event,
+            job.progress,
+        )
+        job.future.add_done_callback(lambda f: self._on_done(job, f))
+        return job
+
+    def cancel(self, job):
+        """Queued jobs are dropped, running ones stop at the next band."""
+        if not job.done.is_set():
+            job.cancel_event.set()
+            job.future.cancel()
+
+    def _on_done(self, job, future):
+        with self.lock:
+            self.in_flight -= 1
+            job.finished = time.time()
+            try:
+                if future.cancelled():
+                    raise star_pipeline.Cancelled("Traitement annulé")
+                job.results, job.timings = future.result()
+                job.status = "done"
+                self.completed += 1
+                for stage, duration in job.timings.items():
+                    self.histograms.setdefault(stage, Histogram()).observe(duration)
+                total = job.finished - job.submitted
+                self.histograms.setdefault("total", Histogram()).observe(total)
+            except star_pipeline.Cancelled as e:
+                job.status = "cancelled"
+                job.error = str(e)
+                self.cancelled += 1
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                self.failed += 1
+            self.finish_times.append(job.finished)
+        job.done.set()
+
+    def _forget_old_jobs(self):
+        finished = [j for j in self.jobs.values() if j.done.is_set()]
+        if len(finished) > MAX_FINISHED_JOBS:
+            finished.sort(key=lambda j: j.finished)
+            for j in finished[: len(finished) - MAX_FINISHED_JOBS]:
+                del self.jobs[j.id]
+
+    def metrics(self):
+        now = time.time()
+        with self.lock:
+            while self.finish_times and now - self.finish_times[0] > THROUGHPUT_WINDOW:
+                self.finish_times.popleft()
+            window = min(THROUGHPUT_WINDOW, now - self.started) or 1.0
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.plan.threads,
+                # Jobs beyond the number of workers are waiting for one
+                "queue_depth": max(self.in_flight - self.workers, 0),
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "throughput_jobs_per_s": len(self.finish_times) / window,
+                "latency_seconds": {
+                    stage: h.to_dict() for stage, h in self.histograms.items()
+                },
+            }
+
+
+def _parse_value(name, value):
+    """Query string values are numbers for every pipeline parameter."""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} doit être un nombre (reçu : {value!r})") from None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "StarReduction/1.0"
+
+    def log_message(self, format, *args):
+        # Keep the console quiet, metrics are exposed on /metrics
+        pass
+
+    def _send_json(self, code, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server.job_server
+        parts = urlsplit(self.path).path.strip("/").split("/")
+
+        if parts == ["metrics"]:
+            return self._send_json(200, server.metrics())
+
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = server.jobs.get(parts[1])
+            if job is None:
+                return self._send_json(404, {"error": "Job inconnu"})
+            if len(parts) == 2:
+                return self._send_json(200, job.to_dict())
+
+            name = parts[2].removesuffix(".png")
+            if name not in job.results:
+                return self._send_json(404, {"error": "Résultat indisponible"})
+            body = job.results[name]
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self._send_json(404, {"error": "Route inconnue"})
+
+    def do_DELETE(self):
+        server = self.server.job_server
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._send_json(404, {"error": "Route inconnue"})
+        job = server.jobs.get(parts[1])
+        if job is None:
+            return self._send_json(404, {"error": "Job inconnu"})
+        server.cancel(job)
+        self._send_json(202, job.to_dict())
+
+    def do_POST(self):
+        server = self.server.job_server
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            return self._send_json(404, {"error": "Route inconnue"})
+
+        query = dict(parse_qsl(url.query))
+        wait = query.pop("wait", "0") not in ("0", "false", "")
+        output_dir = query.pop("output_dir", None)
+        stretch_method = query.pop("stretch", "linear")
+        dtype = query.pop("dtype", "uint8")
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                request = json.loads(body or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("Le corps JSON doit être un objet")
+                source = request["path"]
+                params = request.get("params", {})
+                if not isinstance(source, str):
+                    raise ValueError("'path' doit être un chemin")
+                if not isinstance(params, dict):
+                    raise ValueError("'params' doit être un objet")
+                wait = request.get("wait", wait)
+                if not isinstance(wait, bool):
+                    raise ValueError("'wait' doit être true ou false")
+                output_dir = request.get("output_dir", output_dir)
+                stretch_method = request.get("stretch", stretch_method)
+                dtype = request.get("dtype", dtype)
+            else:
+                source = body
+                params = {k: _parse_value(k, v) for k, v in query.items()}
+            star_pipeline.check_params(params)
+            if stretch_method not in STRETCHES:
+                raise ValueError(f"Étirement inconnu : {stretch_method}")
+            if dtype not in star_pipeline.WORKING_DTYPES:
+                raise ValueError(f"Type d'image non géré : {dtype}")
+            if not source:
+                raise ValueError("Aucune image FITS fournie")
+            if output_dir is not None:
+                output_dir = server.output_path(output_dir)
+        except (KeyError, TypeError, ValueError) as e:
+            return self._send_json(400, {"error": str(e)})
+
+        job = server.submit(source, params, output_dir, stretch_method, dtype)
+        if not wait:
+            return self._send_json(202, job.to_dict())
+
+        job.done.wait()
+        self._send_json(200 if job.status == "done" else 500, job.to_dict())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur local de Star Reduction")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--output-root",
+        default=None,
+        help="Dossier où les jobs peuvent écrire leurs résultats (output_dir)",
+    )
+    args = parser.parse_args()
+
+    server = JobServer(args.host, args.port, args.workers, args.output_root)
+    print(f"Serveur prêt sur {server.address} ({server.workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,8 +1,7 @@
 import sys
 import os
+import time
 import cv2 as cv
-import numpy as np
-from astropy.io import fits
 from PyQt6.QtWidgets import (
     QApplication,
     QWidget,
@@ -13,10 +12,23 @@ from PyQt6.QtWidgets import (
     QSpacerItem,
     QSizePolicy,
     QFileDialog,
+    QProgressDialog,
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
 from gui_star_reduction import StarModel, StarView, StarController
 from gui_comparison import ComparisonView
+import packed_mask
+import star_pipeline
+import thread_policy
+
+# Resolution of the batch progress bar
+PROGRESS_STEPS = 1000
+STAGE_LABELS = {
+    "erosion": "Érosion",
+    "mask": "Masque des étoiles",
+    "inpaint": "Inpainting",
+    "fusion": "Fusion",
+}
 
 
 class Launcher(QWidget):
@@ -94,112 +106,140 @@ class Launcher(QWidget):
         self.close()
 
     def process_batch(self):
-        filepath, _ = QFileDialog.getOpenFileName(
+        filepaths, _ = QFileDialog.getOpenFileNames(
             self,
-            "Sélectionner une image FITS",
+            "Sélectionner des images FITS",
             "./examples",
             "FITS Files (*.fits *.fit)",
         )
-        if not filepath:
+        if not filepaths:
             return
 
-        try:
-            # Constants from prototype_phase3.py
-            IMAGE_EROSION_SIZE = 3
-            IMAGE_EROSION_ITER = 1
-            MASK_BLOCK = 31
-            MASK_C = -2
-            OPENING_KERNEL_SIZE = 3
-            MASK_DILATE_ITER = 3
-            INPAINT_RADIUS = 5
-            REDUCTION_ALPHA = 0.6
-            BLUR_SIZE = 15
-
-            if not os.path.exists("./results"):
-                os.makedirs("./results")
-
-            # Load
-            hdul = fits.open(filepath)
-            data = hdul[0].data
-            hdul.close()
-
-            # Normalize
-            data_norm = (data - data.min()) / (data.max() - data.min())
-
-            # Format handling
-            if data.ndim == 3:
-                if data.shape[0] == 3:
-                    data_norm = np.transpose(data_norm, (1, 2, 0))
-                image = (data_norm * 255).astype("uint8")
-                image = cv.cvtColor(image, cv.COLOR_RGB2BGR)
-                gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-            else:
-                image = (data_norm * 255).astype("uint8")
-                gray = image
-
-            # Save Original
-            cv.imwrite("./results/original.png", image)
-
-            # 1. Erosion
-            kernel_img = np.ones((IMAGE_EROSION_SIZE, IMAGE_EROSION_SIZE), np.uint8)
-            image_eroded_step1 = cv.erode(
-                image, kernel_img, iterations=IMAGE_EROSION_ITER
-            )
-
-            # 2. Mask
-            mask = cv.adaptiveThreshold(
-                gray,
-                255,
-                cv.ADAPTIVE_THRESH_GAUSSIAN_C,
-                cv.THRESH_BINARY,
-                MASK_BLOCK,
-                MASK_C,
-            )
-            kernel_m = np.ones((OPENING_KERNEL_SIZE, OPENING_KERNEL_SIZE), np.uint8)
-            mask_cleaned = cv.morphologyEx(mask, cv.MORPH_OPEN, kernel_m)
-            mask_dilated = cv.dilate(
-                mask_cleaned, kernel_m, iterations=MASK_DILATE_ITER
-            )
-
-            # Save Mask
-            cv.imwrite("./results/star_mask.png", mask_dilated)
-
-            # 3. Inpaint
-            eroded_final = cv.inpaint(
-                image_eroded_step1, mask_dilated, INPAINT_RADIUS, cv.INPAINT_TELEA
+        self.batch_worker = BatchWorker(filepaths)
+        self.progress_dialog = QProgressDialog(
+            "Chargement...", "Annuler", 0, PROGRESS_STEPS, self
+        )
+        self.progress_dialog.setWindowTitle("Générer Images (Batch)")
+        self.progress_dialog.setWindowModality(Qt.WindowModality.WindowModal)
+        self.progress_dialog.setMinimumDuration(0)
+        self.progress_dialog.canceled.connect(self.batch_worker.cancel.cancel)
+
+        self.batch_worker.progress.connect(self.update_batch_progress)
+        self.batch_worker.finished_batch.connect(self.on_batch_finished)
+        self.batch_started = time.perf_counter()
+        self.batch_worker.start()
+
+    def update_batch_progress(self, text, fraction):
+        # ETA from the elapsed time and the weighted progress of the stages
+        elapsed = time.perf_counter() - self.batch_started
+        if fraction > 0.02:
+            remaining = elapsed * (1 - fraction) / fraction
+            text += f"\nTemps restant estimé : {remaining:.0f} s"
+        self.progress_dialog.setLabelText(text)
+        self.progress_dialog.setValue(int(fraction * PROGRESS_STEPS))
+
+    def on_batch_finished(self, status, message):
+        self.progress_dialog.reset()
+        if status == "done":
+            QMessageBox.information(self, "Succès", message)
+        elif status == "cancelled":
+            QMessageBox.information(self, "Annulé", message)
+        else:
+            QMessageBox.critical(
+                self, "Erreur", f"Une erreur est survenue : {message}"
             )
 
-            # Save Eroded (Inpainted version as per prototype naming)
-            cv.imwrite("./results/eroded.png", eroded_final)
-
-            # 4. Fusion
-            mask_blurred = cv.GaussianBlur(mask_dilated, (BLUR_SIZE, BLUR_SIZE), 0)
-            M = mask_blurred.astype(np.float32) / 255.0
-            if image.ndim == 3:
-                M = np.stack([M] * 3, axis=-1)
-
-            Ioriginal = image.astype(np.float32)
-            Ieroded = eroded_final.astype(np.float32)
 
-            final_image_float = (M * REDUCTION_ALPHA * Ieroded) + (
-                1.0 - (M * REDUCTION_ALPHA)
-            ) * Ioriginal
-            final_image = np.clip(final_image_float, 0, 255).astype(np.uint8)
+class BatchWorker(QThread):
+    """Generates the 4 images of each file in a background thread."""
 
-            # Save Final
-            cv.imwrite("./results/final_phase3.png", final_image)
+    # Description of the current step, fraction of the whole batch (0 to 1)
+    progress = pyqtSignal(str, float)
+    # "done", "cancelled" or "failed", and a message
+    finished_batch = pyqtSignal(str, str)
 
-            QMessageBox.information(
-                self,
-                "Succès",
-                "Les 4 images ont été générées dans le dossier ./results/",
+    def __init__(self, filepaths):
+        super().__init__()
+        self.filepaths = filepaths
+        self.cancel = star_pipeline.CancelToken()
+
+    def run(self):
+        # Constants from prototype_phase3.py
+        params = {
+            "erosion_size": 3,
+            "erosion_iter": 1,
+            "thresh_block": 31,
+            "thresh_c": -2,
+            "opening_kernel": 3,
+            "dilate_iter": 3,
+            "inpaint_radius": 5,
+            "reduction_alpha": 60,
+            "blur_kernel": 15,
+        }
+        STRETCH = "linear"
+
+        count = len(self.filepaths)
+        failures = []
+        try:
+            for index, filepath in enumerate(self.filepaths):
+                # A single file keeps the historical ./results/ layout
+                output_dir = "./results"
+                if count > 1:
+                    name = os.path.splitext(os.path.basename(filepath))[0]
+                    output_dir = os.path.join(output_dir, name)
+                os.makedirs(output_dir, exist_ok=True)
+
+                prefix = f"Fichier {index + 1}/{count} : {os.path.basename(filepath)}"
+                self.progress.emit(f"{prefix}\nChargement", index / count)
+                self.cancel.check()
+
+                # Load and normalize (see stretch.py), a bad file is skipped
+                try:
+                    image = star_pipeline.load_image(filepath, STRETCH)
+                except Exception as e:
+                    failures.append(f"{os.path.basename(filepath)} : {e}")
+                    continue
+                # Save Original
+                cv.imwrite(os.path.join(output_dir, "original.png"), image)
+
+                def report(stage, done, total):
+                    fraction = star_pipeline.overall_progress(stage, done, total)
+                    text = f"{prefix}\n{STAGE_LABELS[stage]}"
+                    self.progress.emit(text, (index + fraction) / count)
+
+                results = star_pipeline.reduce_stars(
+                    image, params, progress=report, cancel=self.cancel
+                )
+
+                # Save Mask, Eroded (Inpainted version as per prototype naming)
+                # and Final
+                packed_mask.imwrite(
+                    os.path.join(output_dir, "star_mask.png"), results["mask"]
+                )
+                cv.imwrite(os.path.join(output_dir, "eroded.png"), results["eroded"])
+                cv.imwrite(
+                    os.path.join(output_dir, "final_phase3.png"), results["final"]
+                )
+
+        except star_pipeline.Cancelled:
+            self.finished_batch.emit(
+                "cancelled", f"Traitement annulé ({index} fichier(s) terminé(s))."
             )
-
         except Exception as e:
-            QMessageBox.critical(self, "Erreur", f"Une erreur est survenue : {str(e)}")
+            self.finished_batch.emit("failed", str(e))
+        else:
+            if len(failures) == count:
+                return self.finished_batch.emit("failed", "\n".join(failures))
+            where = "./results/" if count == 1 else "des sous-dossiers de ./results/"
+            message = f"Les 4 images ont été générées dans {where}"
+            if failures:
+                message += "\n\nFichiers ignorés :\n" + "\n".join(failures)
+            self.finished_batch.emit("done", message)
 
 
 if __name__ == "__main__":
+    # Batches run one image at a time : OpenCV uses every core
+    thread_policy.apply(thread_policy.plan("interactive"))
     app = QApplication(sys.argv)
     launcher = Launcher()
     launcher.show()
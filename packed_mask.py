@@ -0,0 +1,155 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Star masks with one bit per pixel.
+#
+# OpenCV works on 0/255 uint8 masks (one byte per pixel). A PackedMask keeps
+# the rows packed 8 pixels per byte (np.packbits, first pixel in the high bit),
+# which is what the caches hold. The conversions cost one pass over the mask,
+# and union, area, bounding box and square dilation work on the packed bytes
+# directly (8 pixels per operation).
+#
+# On disk, masks are written as 1-bit PNG files : any image viewer or
+# cv.imread still reads them as 0/255 images.
+
+import cv2 as cv
+import numpy as np
+
+# PNG options of the mask files (1 bit per pixel)
+PNG_PARAMS = [cv.IMWRITE_PNG_BILEVEL, 1, cv.IMWRITE_PNG_COMPRESSION, 3]
+
+
+def imwrite(path, mask):
+    """Writes a 0/255 mask as a 1-bit PNG file."""
+    return cv.imwrite(path, mask, PNG_PARAMS)
+
+
+def imencode(mask):
+    """Encodes a 0/255 mask as 1-bit PNG bytes."""
+    ok, buf = cv.imencode(".png", mask, PNG_PARAMS)
+    if not ok:
+        raise RuntimeError("Encodage PNG du masque impossible")
+    return buf.tobytes()
+
+
+def _pull_columns(bits, shift):
+    """Pixel x of the result is pixel x + shift of ``bits`` (0 outside)."""
+    out = np.zeros_like(bits)
+    q, r = divmod(shift, 8)
+    src = bits[:, q:]
+    dst = out[:, : bits.shape[1] - q]
+    if r:
+        np.left_shift(src, r, out=dst)
+        dst[:, :-1] |= src[:, 1:] >> (8 - r)
+    else:
+        dst[...] = src
+    return out
+
+
+def _pull_rows(bits, shift):
+    """Row y of the result is row y + shift of ``bits`` (0 outside)."""
+    out = np.zeros_like(bits)
+    out[: bits.shape[0] - shift] = bits[shift:]
+    return out
+
+
+def _window_or(bits, width, pull):
+    """OR of ``width`` consecutive pixels from each one, in log2(width) passes."""
+    span = 1
+    while span * 2 <= width:
+        bits |= pull(bits, span)
+        span *= 2
+    if width > span:
+        bits |= pull(bits, width - span)
+    return bits
+
+
+class PackedMask:
+    """Binary mask with one bit per pixel."""
+
+    def __init__(self, bits, width):
+        self.bits = bits
+        self.width = width
+
+    @classmethod
+    def from_array(cls, mask):
+        """Packs an OpenCV mask (any non-zero pixel is set)."""
+        return cls(np.packbits(mask, axis=1), mask.shape[1])
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_array(cv.imread(path, cv.IMREAD_GRAYSCALE))
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self.width
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def to_array(self, value=255):
+        """OpenCV form : uint8 image with ``value`` on the set pixels."""
+        mask = np.unpackbits(self.bits, axis=1, count=self.width)
+        if value != 1:
+            mask *= np.uint8(value)
+        return mask
+
+    def save(self, path):
+        return imwrite(path, self.to_array())
+
+    def __or__(self, other):
+        return PackedMask(self.bits | other.bits, self.width)
+
+    def __and__(self, other):
+        return PackedMask(self.bits & other.bits, self.width)
+
+    def __eq__(self, other):
+        return self.width == other.width and np.array_equal(self.bits, other.bits)
+
+    def area(self):
+        """Number of set pixels."""
+        return int(np.bitwise_count(self.bits).sum())
+
+    def bbox(self):
+        """(x, y, w, h) of the set pixels, None for an empty mask."""
+        rows = np.flatnonzero(self.bits.any(axis=1))
+        if rows.size == 0:
+            return None
+        y0, y1 = rows[0], rows[-1] + 1
+        columns = np.bitwise_or.reduce(self.bits[y0:y1], axis=0)
+        cols = np.flatnonzero(np.unpackbits(columns, count=self.width))
+        x0, x1 = cols[0], cols[-1] + 1
+        return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+    def dilate(self, radius):
+        """Dilation by a (2 * radius + 1) square, same as cv.dilate.
+
+        Costs log2(radius) passes over the packed rows, whatever the radius.
+        """
+        if radius <= 0:
+            return PackedMask(self.bits.copy(), self.width)
+        height, row_bytes = self.bits.shape
+        window = 2 * radius + 1
+
+        # Zero padding (whole bytes on the left) so that every window is
+        # computed from the pixels at its start
+        pad_bytes = -(-radius // 8)
+        bits = np.zeros((height + radius, row_bytes + pad_bytes), np.uint8)
+        bits[radius:, pad_bytes:] = self.bits
+
+        # 1. Horizontal : OR over the window, then back to the mask columns
+        bits = _window_or(bits, window, _pull_columns)
+        bits = _pull_columns(bits, 8 * pad_bytes - radius)[:, :row_bytes]
+        # 2. Vertical
+        bits = _window_or(np.ascontiguousarray(bits), window, _pull_rows)[:height]
+
+        # Pixels pushed beyond the last column are not part of the mask
+        padding = -self.width % 8
+        if padding:
+            bits[:, -1] &= np.uint8((0xFF << padding) & 0xFF)
+        return PackedMask(bits, self.width)
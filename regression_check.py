@@ -0,0 +1,629 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Golden output and performance regression checks.
+#
+# The star reduction can be run from several entry points : the script
+# erosion_phase3.py, the batch of the launcher (Launcher.process_batch ->
+# BatchWorker), the real-time editor (StarModel.process_image), the job server
+# and star_pipeline.reduce_stars itself. Each of them is run on synthetic
+# FITS frames (grayscale 16-bit, colour float32) and on the examples, and:
+#
+#   1. Its images are compared with the golden images of golden/. Entry
+#      points running the same algorithm share the same golden images, so
+#      they must also agree with each other. Variants : "standard" (script,
+#      batch, job server, pipeline), "gui" (the editor inpaints the original
+#      image instead of the eroded one ; its regions of interest, pasted into
+#      the full render, must give the same image), "adaptive" (per-star
+#      mode), "uint16" and "float32" (high bit depth pipeline), "packed" (1-bit
+#      masks of packed_mask.py, which must also agree exactly with OpenCV).
+#      A difference of more than PIXEL_TOLERANCE gray levels on more than
+#      CHANGED_TOLERANCE of the pixels is a failure.
+#
+#   2. Its per-stage timings (best of --repeat runs) and its memory peak
+#      (numpy / OpenCV arrays of this process, tracemalloc) are compared with
+#      golden/baselines.json. Exceeding a baseline by more than the tolerance
+#      is a failure if new runs confirm it. The baselines are scaled by the
+#      speed of the machine, measured on a fixed workload before the checks
+#      (and again before confirming a failure) and compared with the speed
+#      recorded with the baselines : a busy machine is not a regression.
+#      The job server runs in other processes : timings only.
+#
+# The baselines depend on the machine : update them (--update) on the machine
+# running the checks, after checking that a change of the images is wanted.
+#
+# Use : python regression_check.py [--update] [--only NAME] [--repeat N]
+#                                  [--time-tolerance 0.25]
+#                                  [--memory-tolerance 0.2]
+# Exit code 1 when a check fails.
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import cv2 as cv
+import numpy as np
+from astropy.io import fits
+
+import fast_filters
+import star_pipeline
+from packed_mask import PackedMask, imencode
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_DIR = os.path.join(ROOT, "golden")
+BASELINES_PATH = os.path.join(GOLDEN_DIR, "baselines.json")
+
+# Image tolerances : gray levels (8-bit scale) and fraction of the pixels
+PIXEL_TOLERANCE = 1
+CHANGED_TOLERANCE = 0.001
+# Default performance tolerances (fraction above the baseline)
+TIME_TOLERANCE = 0.25
+MEMORY_TOLERANCE = 0.20
+# Timing differences below this are noise (seconds)
+MIN_TIME_DELTA = 0.05
+# Runs of the calibration workload (best one kept)
+CALIBRATION_RUNS = 5
+
+# Same values as the sliders of the editor and DEFAULT_PARAMS
+PARAMS = star_pipeline.merge_params()
+# Regions of interest of the "gui_roi" case : centres (fractions of the
+# frame width and height) and side (pixels)
+ROI_CENTRES = ((0.5, 0.5), (0.25, 0.75))
+ROI_SIZE = 96
+# Dilation radii of the "packed_mask" case (the image kept is the last one)
+PACKED_RADII = (1, 3, 20, 8)
+
+
+# --- Inputs ---
+def synthetic_frame(height, width, stars, colour=False, seed=0):
+    """FITS data of a star field with a sky gradient and a galaxy.
+
+    16-bit integers for grayscale frames, float32 RGB planes for colour.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width].astype(np.float32)
+    sky = 1000.0 + 300.0 * xx / width + rng.normal(0.0, 20.0, (height, width))
+    # Extended object : must not be treated as a star
+    sky += 8000.0 * np.exp(-((yy - height / 3) ** 2 + (xx - width / 3) ** 2) / 800.0)
+
+    planes = np.repeat(sky[None], 3 if colour else 1, axis=0)
+    for _ in range(stars):
+        y, x = rng.uniform(0, height), rng.uniform(0, width)
+        sigma = rng.uniform(0.7, 3.0)
+        peak = rng.uniform(500.0, 50000.0)
+        r = int(4 * sigma) + 1
+        y0, y1 = max(int(y) - r, 0), min(int(y) + r + 1, height)
+        x0, x1 = max(int(x) - r, 0), min(int(x) + r + 1, width)
+        spot = peak * np.exp(
+            -((yy[y0:y1, x0:x1] - y) ** 2 + (xx[y0:y1, x0:x1] - x) ** 2)
+            / (2 * sigma * sigma)
+        )
+        tint = rng.uniform(0.6, 1.0, (planes.shape[0], 1, 1))
+        planes[:, y0:y1, x0:x1] += tint * spot
+
+    planes = np.clip(planes, 0, 65535)
+    if colour:
+        return (planes / 65535.0).astype(np.float32)
+    return planes[0].astype(np.uint16)
+
+
+def prepare_inputs(directory):
+    """Input name -> FITS path (synthetic frames written to ``directory``)."""
+    inputs = {}
+    for name, data in (
+        ("synthetic_gray", synthetic_frame(512, 512, 300)),
+        ("synthetic_colour", synthetic_frame(384, 384, 200, colour=True, seed=1)),
+    ):
+        path = os.path.join(directory, f"{name}.fits")
+        fits.writeto(path, data, overwrite=True)
+        inputs[name] = path
+    for path in sorted(glob.glob(os.path.join(ROOT, "examples", "*.fits"))):
+        inputs[os.path.splitext(os.path.basename(path))[0]] = path
+    return inputs
+
+
+# --- Entry points ---
+# Each one returns (images, timings) ; "total" is the wall time of the run.
+def run_pipeline(path, workdir, params=None, dtype=np.uint8):
+    timings = {}
+    t0 = time.perf_counter()
+    image = star_pipeline.load_image(path, "linear", dtype)
+    timings["load"] = time.perf_counter() - t0
+    results = star_pipeline.reduce_stars(image, params or PARAMS, timings)
+    timings["total"] = time.perf_counter() - t0
+    return results, timings
+
+
+def run_adaptive(path, workdir):
+    results, timings = run_pipeline(path, workdir, dict(PARAMS, adaptive=1))
+    return {"final": results["final"], "mask": results["mask"]}, timings
+
+
+def run_uint16(path, workdir):
+    results, timings = run_pipeline(path, workdir, dtype=np.uint16)
+    return {"final": results["final"]}, timings
+
+
+def run_float32(path, workdir):
+    results, timings = run_pipeline(path, workdir, dtype=np.float32)
+    return {"final": results["final"]}, timings
+
+
+def _read_results(directory):
+    """Mask, eroded and final images written by the script or the batch."""
+    names = {"mask": "star_mask.png", "eroded": "eroded.png", "final": "final_phase3.png"}
+    return {
+        name: cv.imread(os.path.join(directory, filename), cv.IMREAD_UNCHANGED)
+        for name, filename in names.items()
+    }
+
+
+@contextlib.contextmanager
+def _working_directory(path):
+    previous = os.getcwd()
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def run_erosion_phase3(path, workdir):
+    """The script, in-process, with its configuration values.
+
+    process_file is the script without main() : the thread settings of this
+    process are left as they are.
+    """
+    import erosion_phase3
+
+    t0 = time.perf_counter()
+    with _working_directory(workdir), contextlib.redirect_stdout(io.StringIO()):
+        erosion_phase3.process_file(path)
+    timings = {"total": time.perf_counter() - t0}
+    return _read_results(os.path.join(workdir, "results")), timings
+
+
+def run_launcher_batch(path, workdir):
+    """BatchWorker (what Launcher.process_batch starts), without the dialogs."""
+    from launcher import BatchWorker
+
+    worker = BatchWorker([path])
+    outcome = {}
+    worker.finished_batch.connect(
+        lambda status, message: outcome.update(status=status, message=message)
+    )
+    t0 = time.perf_counter()
+    with _working_directory(workdir):
+        worker.run()
+    timings = {"total": time.perf_counter() - t0}
+    if outcome.get("status") != "done":
+        raise RuntimeError(outcome.get("message", "Traitement par lot interrompu"))
+    return _read_results(os.path.join(workdir, "results")), timings
+
+
+def run_gui_model(path, workdir):
+    """StarModel.process_image, as the editor calls it for a full render."""
+    from gui_star_reduction import StarModel
+
+    model = StarModel()
+    t0 = time.perf_counter()
+    if not model.load_fits_data(path):
+        raise RuntimeError(f"Lecture impossible : {path}")
+    t1 = time.perf_counter()
+    final = model.process_image(dict(PARAMS))
+    t2 = time.perf_counter()
+    return {"final": final}, {"load": t1 - t0, "process": t2 - t1, "total": t2 - t0}
+
+
+def run_gui_roi(path, workdir):
+    """Regions of interest of the editor, pasted into its full render.
+
+    Each region must be exactly the crop of the full render, and one of them
+    at least must go through the growth of its area (groups of stars cut by
+    the area border), else the case fails.
+    """
+    import gui_star_reduction
+
+    model = gui_star_reduction.StarModel()
+    t0 = time.perf_counter()
+    if not model.load_fits_data(path):
+        raise RuntimeError(f"Lecture impossible : {path}")
+    t1 = time.perf_counter()
+    final = model.process_image(dict(PARAMS))
+    t2 = time.perf_counter()
+
+    # Each pass of the area loop of _process_roi expands two boxes
+    expand_box = gui_star_reduction._expand_box
+    boxes = []
+
+    def counting_expand_box(*args):
+        boxes.append(args)
+        return expand_box(*args)
+
+    gui_star_reduction._expand_box = counting_expand_box
+    try:
+        composite = final.copy()
+        grown = False
+        height, width = final.shape[:2]
+        for fx, fy in ROI_CENTRES:
+            x = min(max(int(width * fx) - ROI_SIZE // 2, 0), width - ROI_SIZE)
+            y = min(max(int(height * fy) - ROI_SIZE // 2, 0), height - ROI_SIZE)
+            roi = (x, y, ROI_SIZE, ROI_SIZE)
+            boxes.clear()
+            image = model.process_image(dict(PARAMS), roi=roi)
+            grown |= len(boxes) > 2
+            area = (slice(y, y + ROI_SIZE), slice(x, x + ROI_SIZE))
+            if not np.array_equal(image, final[area]):
+                raise RuntimeError(f"La zone {roi} diffère de l'image entière")
+            composite[area] = image
+    finally:
+        gui_star_reduction._expand_box = expand_box
+    if not grown:
+        raise RuntimeError("Aucune zone n'a dû être agrandie (halo des groupes)")
+    t3 = time.perf_counter()
+
+    timings = {"load": t1 - t0, "process": t2 - t1, "roi": t3 - t2, "total": t3 - t0}
+    return {"final": composite}, timings
+
+
+def _packed_mismatch(mask):
+    """What a PackedMask of ``mask`` gives differently from OpenCV, or None."""
+    packed = PackedMask.from_array(mask)
+    if not np.array_equal(packed.to_array(), (mask != 0) * np.uint8(255)):
+        return "to_array"
+    if packed.area() != cv.countNonZero(mask):
+        return "area"
+    bbox = cv.boundingRect(mask) if packed.area() else None
+    if packed.bbox() != bbox:
+        return f"bbox {packed.bbox()} au lieu de {bbox}"
+    png = cv.imdecode(np.frombuffer(imencode(mask), np.uint8), cv.IMREAD_UNCHANGED)
+    if not np.array_equal(png, packed.to_array()):
+        return "PNG 1 bit"
+    return None
+
+
+def run_packed_mask(path, workdir):
+    """PackedMask against the uint8 masks of OpenCV, on the detected stars.
+
+    Dilation (PACKED_RADII), area, bounding box, conversions and 1-bit PNG
+    must agree exactly, also on an empty mask ; the golden image is the last
+    dilation.
+    """
+    t0 = time.perf_counter()
+    image = star_pipeline.load_image(path, "linear")
+    gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    detected = fast_filters.detect_stars(
+        gray, PARAMS["thresh_block"], PARAMS["thresh_c"], PARAMS["opening_kernel"]
+    )
+    t1 = time.perf_counter()
+
+    for mask in (detected, np.zeros_like(detected)):
+        mismatch = _packed_mismatch(mask)
+        if mismatch:
+            raise RuntimeError(f"PackedMask diffère d'OpenCV : {mismatch}")
+    packed = PackedMask.from_array(detected)
+    for radius in PACKED_RADII:
+        kernel = np.ones((2 * radius + 1, 2 * radius + 1), np.uint8)
+        expected = cv.dilate(detected, kernel)
+        dilated = packed.dilate(radius).to_array()
+        if not np.array_equal(dilated, expected):
+            raise RuntimeError(f"PackedMask diffère d'OpenCV : dilatation {radius}")
+        mismatch = _packed_mismatch(expected)
+        if mismatch:
+            raise RuntimeError(
+                f"PackedMask diffère d'OpenCV : {mismatch} (dilatation {radius})"
+            )
+    t2 = time.perf_counter()
+
+    timings = {"load": t1 - t0, "masks": t2 - t1, "total": t2 - t0}
+    return {"dilated": dilated}, timings
+
+
+_servers = {}
+
+
+def run_job_server(path, workdir):
+    """One job through the HTTP API of a job server started once."""
+    from job_server import JobServer
+
+    if "job_server" not in _servers:
+        _servers["job_server"] = JobServer(port=0, workers=1).start()
+    address = _servers["job_server"].address
+
+    t0 = time.perf_counter()
+    body = json.dumps({"path": path, "params": PARAMS, "wait": True}).encode()
+    request = urllib.request.Request(
+        address + "/jobs", body, {"Content-Type": "application/json"}, method="POST"
+    )
+    with urllib.request.urlopen(request) as response:
+        job = json.loads(response.read())
+    if job["status"] != "done":
+        raise RuntimeError(job.get("error") or job["status"])
+
+    images = {}
+    for name in ("mask", "eroded", "final"):
+        with urllib.request.urlopen(f"{address}/jobs/{job['job_id']}/{name}.png") as r:
+            buf = np.frombuffer(r.read(), np.uint8)
+        images[name] = cv.imdecode(buf, cv.IMREAD_UNCHANGED)
+    timings = dict(job["timings"], total=time.perf_counter() - t0)
+    return images, timings
+
+
+def stop_servers():
+    for server in _servers.values():
+        server.stop()
+    _servers.clear()
+
+
+# Name : (function, golden variant, runs in this process)
+ENTRY_POINTS = {
+    "star_pipeline": (run_pipeline, "standard", True),
+    "erosion_phase3": (run_erosion_phase3, "standard", True),
+    "launcher_batch": (run_launcher_batch, "standard", True),
+    "job_server": (run_job_server, "standard", False),
+    "gui_model": (run_gui_model, "gui", True),
+    "gui_roi": (run_gui_roi, "gui", True),
+    "adaptive": (run_adaptive, "adaptive", True),
+    "uint16": (run_uint16, "uint16", True),
+    "float32": (run_float32, "float32", True),
+    "packed_mask": (run_packed_mask, "packed", True),
+}
+
+
+# --- Checks ---
+def best_timings(run, path, workdir, repeat, best=None):
+    """Shortest time of each stage over ``repeat`` runs (and ``best``)."""
+    best = dict(best or {})
+    for _ in range(repeat):
+        _, timings = run(path, workdir)
+        for stage, duration in timings.items():
+            best[stage] = min(duration, best.get(stage, duration))
+    return best
+
+
+def calibrate():
+    """Time of a fixed OpenCV workload, in seconds (best of CALIBRATION_RUNS).
+
+    It does not use the code of the repository : a regression of the
+    pipeline must not change the measured speed of the machine.
+    """
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (512, 512), dtype=np.uint8)
+    mask = np.zeros_like(image)
+    for y, x in rng.integers(8, 504, (300, 2)):
+        cv.circle(mask, (int(x), int(y)), 3, 255, -1)
+    kernel = cv.getStructuringElement(cv.MORPH_ELLIPSE, (5, 5))
+
+    best = None
+    for _ in range(CALIBRATION_RUNS + 1):  # The first one warms up
+        t0 = time.perf_counter()
+        cv.inpaint(image, mask, 3, cv.INPAINT_TELEA)
+        cv.GaussianBlur(image, (0, 0), 2.0)
+        cv.morphologyEx(image, cv.MORPH_OPEN, kernel)
+        duration = time.perf_counter() - t0
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def slowdown(calibration, baselines):
+    """How much slower the machine is than when the baselines were measured.
+
+    Never below 1 : a faster machine keeps the recorded baselines.
+    """
+    reference = baselines.get("calibration")
+    if not reference:
+        return 1.0
+    return max(calibration / reference, 1.0)
+
+
+def measure(run, path, workdir, repeat, traced):
+    """Images, best timings of ``repeat`` runs and memory peak (or None).
+
+    A first run (imports, caches, first OpenCV calls) gives the images and
+    is not timed. The memory peak is measured on a run of its own.
+    """
+    images, _ = run(path, workdir)
+    best = best_timings(run, path, workdir, repeat)
+
+    peak = None
+    if traced:
+        tracemalloc.start()
+        try:
+            run(path, workdir)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return images, best, peak
+
+
+def png_form(image):
+    """The image as stored in a PNG file (16-bit above 8 bits)."""
+    buf = np.frombuffer(star_pipeline.encode_image(image), np.uint8)
+    return cv.imdecode(buf, cv.IMREAD_UNCHANGED)
+
+
+def compare_images(image, golden):
+    """Failure message, or None when the images agree within the tolerances."""
+    if image.shape != golden.shape or image.dtype != golden.dtype:
+        return f"{image.shape} {image.dtype} au lieu de {golden.shape} {golden.dtype}"
+    scale = 257 if image.dtype == np.uint16 else 1
+    diff = cv.absdiff(image, golden)
+    changed = np.count_nonzero(diff > PIXEL_TOLERANCE * scale) / diff.size
+    if changed > CHANGED_TOLERANCE:
+        return f"{changed:.2%} des pixels diffèrent (écart max {int(diff.max()) // scale})"
+    return None
+
+
+def compare_performance(
+    timings, peak, baseline, time_tolerance, memory_tolerance, scale=1.0
+):
+    """Failure messages of the timings and memory peak against a baseline.
+
+    Baseline timings are multiplied by ``scale`` (see slowdown).
+    """
+    failures = []
+    for stage, reference in baseline.get("timings", {}).items():
+        duration = timings.get(stage)
+        if duration is None:
+            continue
+        reference *= scale
+        if duration > reference * (1 + time_tolerance) and duration - reference > MIN_TIME_DELTA:
+            failures.append(
+                f"durée {stage} : {duration:.3f} s au lieu de {reference:.3f} s"
+                f" (+{duration / reference - 1:.0%})"
+            )
+    reference = baseline.get("peak_memory")
+    if peak is not None and reference and peak > reference * (1 + memory_tolerance):
+        failures.append(
+            f"pic mémoire : {peak / 2**20:.1f} Mo au lieu de {reference / 2**20:.1f} Mo"
+            f" (+{peak / reference - 1:.0%})"
+        )
+    return failures
+
+
+def load_baselines():
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def check_images(images, input_name, variant, update, written):
+    """Compares (or, when updating, stores) the images of one case.
+
+    When updating, the first entry point of a variant writes its golden
+    images (paths added to ``written``) and the next ones are compared to it.
+    """
+    failures = []
+    golden_dir = os.path.join(GOLDEN_DIR, input_name)
+    for name, image in sorted(images.items()):
+        golden_path = os.path.join(golden_dir, f"{variant}_{name}.png")
+        image = png_form(image)
+        if update and golden_path not in written:
+            os.makedirs(golden_dir, exist_ok=True)
+            cv.imwrite(golden_path, image, [cv.IMWRITE_PNG_COMPRESSION, 9])
+            written.add(golden_path)
+            continue
+        golden = cv.imread(golden_path, cv.IMREAD_UNCHANGED)
+        if golden is None:
+            failures.append(f"{name} : pas d'image de référence")
+            continue
+        message = compare_images(image, golden)
+        if message:
+            failures.append(f"{name} : {message}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Vérifie les images et les performances de chaque point d'entrée"
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Remplace les images et les mesures de référence de golden/",
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        help="Point d'entrée, image ou variante à vérifier (répétable)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Mesures de durée par cas (au moins 1)"
+    )
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    written = set()
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        inputs = prepare_inputs(tmp)
+        calibration = calibrate()
+        scale = slowdown(calibration, baselines)
+        if args.update:
+            baselines["calibration"] = round(calibration, 4)
+        elif scale > 1.0:
+            print(f"Machine {scale:.2f} fois plus lente que lors des références\n")
+        try:
+            for input_name, path in inputs.items():
+                for entry, (run, variant, traced) in ENTRY_POINTS.items():
+                    if args.only and not {entry, input_name, variant} & set(args.only):
+                        continue
+                    case = f"{entry}/{input_name}"
+                    workdir = os.path.join(tmp, entry, input_name)
+                    try:
+                        images, timings, peak = measure(
+                            run, path, workdir, args.repeat, traced
+                        )
+                    except Exception as e:
+                        print(f"{case:<36} ÉCHEC\n    - erreur : {e}")
+                        failed += 1
+                        continue
+
+                    failures = check_images(
+                        images, input_name, variant, args.update, written
+                    )
+                    if args.update:
+                        baselines[case] = {
+                            "timings": {k: round(v, 4) for k, v in timings.items()},
+                            "peak_memory": peak,
+                        }
+                    elif case not in baselines:
+                        failures.append("pas de mesure de référence")
+                    else:
+                        check = (
+                            baselines[case],
+                            args.time_tolerance,
+                            args.memory_tolerance,
+                        )
+                        slow = compare_performance(timings, peak, *check, scale)
+                        if slow:
+                            # Confirmed by new runs, with the current speed of
+                            # the machine : a busy machine is not a regression
+                            scale = slowdown(calibrate(), baselines)
+                            timings = best_timings(
+                                run, path, workdir, args.repeat, timings
+                            )
+                            slow = compare_performance(timings, peak, *check, scale)
+                        failures += slow
+
+                    line = f"{case:<36} {'ÉCHEC' if failures else 'OK':<6}"
+                    line += f" {timings['total']:7.2f} s"
+                    if peak is not None:
+                        line += f" {peak / 2**20:8.1f} Mo"
+                    print(line)
+                    for failure in failures:
+                        print(f"    - {failure}")
+                    failed += bool(failures)
+        finally:
+            stop_servers()
+
+    if args.update:
+        with open(BASELINES_PATH, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"\nRéférences mises à jour dans {GOLDEN_DIR}")
+    if failed:
+        print(f"\n{failed} cas en échec")
+        sys.exit(1)
+    print("\nTous les cas sont conformes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Per-star adaptive reduction ("adaptive" parameter of star_pipeline.py).
+#
+# The standard mode dilates, inpaints and blurs the whole frame with the same
+# settings for every star. Here each connected component of the detection mask
+# (threshold + opening, no dilation) is a star of a catalog : centroid,
+# equivalent radius and peak brightness. Each star gets its own settings :
+#
+#   - scale    : radius relative to the median star (MIN_SCALE to MAX_SCALE).
+#                The halo (dilation radius of the standard mode) and the
+#                transition (width of the blur of the standard mode : 4 sigma)
+#                are multiplied by it.
+#   - strength : reduction_alpha times MIN_STRENGTH for a star barely above
+#                its background, up to reduction_alpha for a saturated star.
+#
+# A star is only processed in a square window around it. The background is a
+# plane fitted (least squares) on the window pixels outside the star and
+# outside any other detected star, then blended over the star with a radial
+# weight going from full to 0 across the transition, centred on radius + halo
+# like the blurred edge of the standard mask.
+# Pixels are only darkened, and where windows overlap the strongest reduction
+# wins.
+#
+# Windows of the same side are stacked and processed together (numpy), so
+# the cost grows with the number and size of the stars : there is no full
+# frame dilation, inpainting or blur. Each batch of windows is written to the
+# output images at once (darkest value of each pixel), so the memory does not
+# grow with the total area of the windows either. Components larger than MAX_STAR_RADIUS
+# are extended objects (galaxy cores, nebulae) and are left untouched.
+#
+# Use : python star_catalog.py  (time against the number of stars and pixels)
+
+import time
+
+import cv2 as cv
+import numpy as np
+
+from fast_filters import gaussian_sigma
+from stretch import output_max
+
+# Larger components (equivalent radius, pixels) are not stars
+MAX_STAR_RADIUS = 48
+# Bounds of the size of a star relative to the median star
+MIN_SCALE = 0.5
+MAX_SCALE = 4.0
+# Share of reduction_alpha applied to a star barely above its background
+MIN_STRENGTH = 0.4
+# Pixels around the reduced disc kept for the background fit
+RING_WIDTH = 3
+# Window sides are rounded up to a multiple of this
+WINDOW_STEP = 4
+# Memory of the windows processed at once (bytes)
+BATCH_BYTES = 8 * 1024 * 1024
+# Memory of one window pixel at the peak of a batch (measured, star covering
+# the window) : basis, weighted basis, distance, profile, index and masks, plus
+# the pixel, background and changes of each channel
+PIXEL_BYTES = 52
+CHANNEL_BYTES = 14
+# Background pixels needed for a fit, stars with less are left untouched
+MIN_RING_PIXELS = 8
+# BGR -> gray weights (same as cv.COLOR_BGR2GRAY)
+GRAY_WEIGHTS = np.array([0.114, 0.587, 0.299], np.float32)
+
+
+class StarCatalog:
+    """Stars of a detection mask, one entry per connected component."""
+
+    def __init__(self, x, y, radius, peak):
+        self.x = x  # Centroid (pixels)
+        self.y = y
+        self.radius = radius  # Equivalent radius of the detected core
+        self.peak = peak  # Brightest gray value
+
+    def __len__(self):
+        return len(self.x)
+
+    def select(self, keep):
+        return StarCatalog(self.x[keep], self.y[keep], self.radius[keep], self.peak[keep])
+
+
+def measure_stars(gray, detected):
+    """Catalog of the components of ``detected`` (0/255), peaks read in ``gray``."""
+    count, labels, stats, centroids = cv.connectedComponentsWithStats(detected)
+    area = stats[1:, cv.CC_STAT_AREA]
+    extent = np.maximum(stats[1:, cv.CC_STAT_WIDTH], stats[1:, cv.CC_STAT_HEIGHT])
+    # Elongated components are covered by their largest extent
+    radius = np.maximum(np.sqrt(area / np.pi), extent / 2).astype(np.float32)
+
+    inside = detected > 0
+    peak = np.zeros(count, np.float32)
+    np.maximum.at(peak, labels[inside], gray[inside])
+    return StarCatalog(centroids[1:, 0], centroids[1:, 1], radius, peak[1:])
+
+
+def star_settings(catalog, params):
+    """Halo and transition width (pixels) of each star.
+
+    The median star gets the dilation and the blur of the standard mode.
+    """
+    median = max(float(np.median(catalog.radius)), 1.0)
+    scale = np.clip(catalog.radius / median, MIN_SCALE, MAX_SCALE)
+    halo = scale * (params["dilate_iter"] * (params["opening_kernel"] // 2))
+    feather = np.maximum(scale * 4 * gaussian_sigma(params["blur_kernel"]), 1.0)
+    return halo.astype(np.float32), feather.astype(np.float32)
+
+
+def _process_windows(image, detected, catalog, reach, feather, alpha, size):
+    """Reduction of a batch of stars sharing the same window side.
+
+    Returns the flat index of the affected pixels and, for each of them, the
+    change giving the starless image and the change giving the final image.
+    """
+    height, width = image.shape[:2]
+    full_scale = output_max(image.dtype)
+
+    # Windows shifted inside the image near the borders
+    x0 = np.clip(np.round(catalog.x).astype(np.int64) - size // 2, 0, width - size)
+    y0 = np.clip(np.round(catalog.y).astype(np.int64) - size // 2, 0, height - size)
+    index_type = np.int32 if height * width <= np.iinfo(np.int32).max else np.int64
+    offsets = np.arange(size, dtype=index_type)
+    ys = (y0.astype(index_type)[:, None] + offsets)[:, :, None]  # (stars, size, 1)
+    xs = (x0.astype(index_type)[:, None] + offsets)[:, None, :]  # (stars, 1, size)
+
+    # Windows as (stars, pixels, channels)
+    count = len(catalog)
+    flat_index = (ys * index_type(width) + xs).reshape(count, -1)
+    windows = image.reshape(height * width, -1)[flat_index].astype(np.float32)
+    busy = detected.reshape(-1)[flat_index] > 0
+
+    # Basis (1, u, v) of each pixel, relative to the centroid (small offsets
+    # inside the window : exact enough in float32)
+    shape = (count, size, size)
+    local = np.arange(size, dtype=np.float32)
+    u = local - (catalog.x - x0).astype(np.float32)[:, None]
+    v = local - (catalog.y - y0).astype(np.float32)[:, None]
+    basis = np.empty((count, size * size, 3), np.float32)
+    basis[..., 0] = 1.0
+    basis[..., 1] = np.broadcast_to(u[:, None, :], shape).reshape(count, -1)
+    basis[..., 2] = np.broadcast_to(v[:, :, None], shape).reshape(count, -1)
+    dist = np.hypot(basis[..., 1], basis[..., 2])
+    r, f = reach[:, None], feather[:, None]
+    profile = np.clip((r + f / 2 - dist) / f, 0.0, 1.0)
+
+    # 1. Background plane a + b * u + c * v (weighted least squares)
+    known = (profile == 0) & ~busy
+    valid = known.sum(axis=1) >= MIN_RING_PIXELS
+    weighted = (basis * known[..., None]).transpose(0, 2, 1)
+    normal = weighted @ basis
+    rhs = weighted @ windows
+    # Slopes slightly pulled to 0 : a thin border gives a flat background
+    normal[:, 1, 1] += 1.0
+    normal[:, 2, 2] += 1.0
+    normal[~valid] = np.eye(3)
+    coef = np.linalg.solve(normal, rhs)
+    background = basis @ coef
+
+    # 2. Strength from the peak above the local background
+    level = coef[:, 0, :]
+    level = level @ GRAY_WEIGHTS if level.shape[1] == 3 else level[:, 0]
+    contrast = (catalog.peak - level) / np.maximum(full_scale - level, 1e-6)
+    strength = alpha * (MIN_STRENGTH + (1.0 - MIN_STRENGTH) * np.clip(contrast, 0, 1))
+
+    # 3. Darkening only, weighted by the radial profile
+    affected = (profile > 0) & valid[:, None]
+    starless = np.minimum(background[affected] - windows[affected], 0.0)
+    starless *= profile[affected][:, None]
+    strength = np.broadcast_to(strength[:, None], affected.shape)[affected]
+    final = starless * strength[:, None].astype(np.float32)
+    return flat_index[affected], starless, final
+
+
+def _fold(result, image, pixels, changes):
+    """Writes a batch of changes of ``image`` to ``result`` (a copy of it).
+
+    Each pixel keeps its darkest value : changes are never positive and the
+    conversion to the working type is monotonic, so this is the strongest
+    reduction of the overlapping windows.
+    """
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    values = image.reshape(-1, channels)[pixels].astype(np.float32) + changes
+    # Back to the working type (truncated, like the fusion of the standard mode)
+    values = np.clip(values, 0, output_max(image.dtype)).astype(image.dtype)
+    np.minimum.at(result.reshape(-1, channels), pixels, values)
+
+
+def reduce_each_star(image, gray, detected, params, report=None):
+    """Per-star reduction of ``image`` (uint8, uint16 or float32).
+
+    ``detected`` is the star mask before dilation. Returns the "mask" (0/255,
+    changed pixels), "eroded" (starless) and "final" images, like
+    star_pipeline.reduce_stars. ``report(done, total)`` is called after each
+    batch of windows (in stars).
+    """
+    height, width = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    results = {
+        "mask": np.zeros((height, width), np.uint8),
+        "eroded": image.copy(),
+        "final": image.copy(),
+    }
+    catalog = measure_stars(gray, detected)
+    catalog = catalog.select(catalog.radius <= MAX_STAR_RADIUS)
+    alpha = params["reduction_alpha"] / 100.0
+    if len(catalog) == 0:
+        return results
+
+    halo, feather = star_settings(catalog, params)
+    reach = catalog.radius + halo
+    side = 2 * np.ceil(reach + feather / 2 + RING_WIDTH).astype(np.int64) + 1
+    side = np.minimum(-(-side // WINDOW_STEP) * WINDOW_STEP, min(height, width))
+
+    total = len(catalog)
+    done = 0
+    if report is not None:
+        report(done, total)
+
+    pixel_bytes = PIXEL_BYTES + CHANNEL_BYTES * channels
+    for size in np.unique(side):
+        stars = np.flatnonzero(side == size)
+        batch = max(1, BATCH_BYTES // (int(size) ** 2 * pixel_bytes))
+        for start in range(0, len(stars), batch):
+            chunk = stars[start : start + batch]
+            pixels, starless, final = _process_windows(
+                image,
+                detected,
+                catalog.select(chunk),
+                reach[chunk],
+                feather[chunk],
+                alpha,
+                int(size),
+            )
+            results["mask"].reshape(-1)[pixels] = 255
+            _fold(results["eroded"], image, pixels, starless)
+            _fold(results["final"], image, pixels, final)
+            done += len(chunk)
+            if report is not None:
+                report(done, total)
+    return results
+
+
+if __name__ == "__main__":
+    import star_pipeline
+
+    def star_field(height, width, stars, seed=0):
+        """Synthetic 8-bit frame with Gaussian stars of various sizes."""
+        rng = np.random.default_rng(seed)
+        image = rng.normal(40, 6, (height, width)).astype(np.float32)
+        ys, xs = rng.integers(0, height, stars), rng.integers(0, width, stars)
+        sigmas = rng.uniform(0.8, 4.0, stars)
+        peaks = rng.uniform(30, 215, stars)
+        for y, x, s, p in zip(ys, xs, sigmas, peaks):
+            r = int(4 * s) + 1
+            y0, y1, x0, x1 = max(y - r, 0), min(y + r + 1, height), max(x - r, 0), min(x + r + 1, width)
+            gy, gx = np.mgrid[y0:y1, x0:x1]
+            image[y0:y1, x0:x1] += p * np.exp(-((gy - y) ** 2 + (gx - x) ** 2) / (2 * s * s))
+        return image.clip(0, 255).astype(np.uint8)
+
+    def timed(params, image):
+        timings = {}
+        t0 = time.perf_counter()
+        star_pipeline.reduce_stars(image, params, timings)
+        return time.perf_counter() - t0, timings
+
+    standard = star_pipeline.merge_params()
+    adaptive = star_pipeline.merge_params({"adaptive": 1})
+    print("Image (Mpx)  étoiles  standard (s)  adaptatif (s)  dont étoiles (s)")
+    for height, width, stars in (
+        (2000, 3000, 2000),
+        (4000, 6000, 2000),
+        (4000, 6000, 8000),
+        (4000, 6000, 32000),
+    ):
+        image = star_field(height, width, stars)
+        t_standard, _ = timed(standard, image)
+        t_adaptive, timings = timed(adaptive, image)
+        local = timings["inpaint"] + timings["fusion"]
+        print(
+            f"{height * width / 1e6:11.0f}  {stars:7d}  {t_standard:12.2f}"
+            f"  {t_adaptive:13.2f}  {local:16.2f}"
+        )
@@ -0,0 +1,474 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Importable version of the Phase 3 algorithm (see erosion_phase3.py for the
+# description of each step). Nothing here prompts, prints or touches the disk,
+# so it can be reused by scripts, the job server and worker processes.
+#
+# Long runs report their progress through a callback and can be stopped by a
+# CancelToken. The erosion, inpainting and fusion work by bands of rows, with
+# exactly the same result as a full frame call, so that progress and
+# cancellation also happen inside a stage.
+#
+# The pipeline runs in the type of the image it is given : uint8 (historical),
+# uint16 or float32 (values in [0, 1]). Every stage works in that type, only
+# the star mask is an 8-bit 0/255 image. High bit depth results are saved as
+# float32 FITS or 16-bit PNG files (save_image).
+#
+# With "adaptive" set to 1, each star gets its own radius and strength and is
+# only processed in a window around it (see star_catalog.py) : the erosion and
+# the full frame dilation, inpainting and blur are skipped.
+#
+# Use : python star_pipeline.py [FITS_FILE]  (time and memory of each type)
+
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import cv2 as cv
+import numpy as np
+from astropy.io import fits
+
+import fast_filters
+import star_catalog
+import stretch
+import thread_policy
+
+# =================================================================
+# DEFAULT PARAMETERS (same keys as the real-time editor sliders)
+# =================================================================
+DEFAULT_PARAMS = {
+    "erosion_size": 3,  # Preventive erosion zone
+    "erosion_iter": 1,
+    "thresh_block": 31,  # Adaptive threshold block (odd)
+    "thresh_c": -2,
+    "opening_kernel": 3,  # Mask cleaning
+    "dilate_iter": 3,  # Halos cover
+    "inpaint_radius": 5,
+    "reduction_alpha": 60,  # Percentage (0-100)
+    "blur_kernel": 15,  # Transition blur (odd)
+    "adaptive": 0,  # 1 : per-star radius and strength (star_catalog.py)
+}
+# Accepted values of each parameter : (minimum, maximum, odd only), the
+# ranges of the editor sliders
+PARAM_LIMITS = {
+    "erosion_size": (1, 15, False),
+    "erosion_iter": (0, 10, False),
+    "thresh_block": (3, 251, True),
+    "thresh_c": (-50, 50, False),
+    "opening_kernel": (3, 21, True),
+    "dilate_iter": (0, 20, False),
+    "inpaint_radius": (1, 20, False),
+    "reduction_alpha": (0, 100, False),
+    "blur_kernel": (3, 101, True),
+    "adaptive": (0, 1, False),
+}
+# Parameters that may be decimal numbers, the others are integers
+FLOAT_PARAMS = ("thresh_c", "reduction_alpha")
+
+# Names of the timed stages, in execution order
+STAGES = ("erosion", "mask", "inpaint", "fusion")
+# Share of the run time of each stage (24 Mpx frame, default parameters)
+STAGE_WEIGHTS = {"erosion": 0.01, "mask": 0.04, "inpaint": 0.88, "fusion": 0.07}
+
+# Height of the bands of rows processed between two progress reports
+TILE_ROWS = 512
+
+# Image types the pipeline works in
+WORKING_DTYPES = ("uint8", "uint16", "float32")
+FITS_EXTENSIONS = (".fits", ".fit")
+
+
+class Cancelled(Exception):
+    """Raised by the pipeline when its CancelToken has been cancelled."""
+
+
+class CancelToken:
+    """Cooperative cancellation flag, checked between stages and bands.
+
+    Calling the token returns True once cancelled, so it can also be given as
+    the ``cancelled`` callable of StarModel.process_image. Any object with
+    set() / is_set() (e.g. a multiprocessing Manager Event) can back it.
+    """
+
+    def __init__(self, event=None):
+        self.event = event if event is not None else threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def __call__(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled("Traitement annulé")
+
+
+def overall_progress(stage, done, total):
+    """Fraction (0 to 1) of a reduce_stars run from a progress report."""
+    fraction = 0.0
+    for name in STAGES:
+        if name == stage:
+            return fraction + STAGE_WEIGHTS[name] * (done / total if total else 1.0)
+        fraction += STAGE_WEIGHTS[name]
+    return 1.0
+
+
+def _reporter(stage, progress, cancel):
+    """Callback (done, total) reporting the progress of one stage."""
+
+    def report(done, total):
+        if progress is not None:
+            progress(stage, done, total)
+        if cancel is not None:
+            cancel.check()
+
+    return report
+
+
+def read_fits(source):
+    """Reads the primary HDU (data, header) from a path or raw FITS bytes."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    with fits.open(source) as hdul:
+        return np.asarray(hdul[0].data), hdul[0].header
+
+
+def working_dtype(dtype):
+    """Checks that the pipeline can work in ``dtype`` (name or numpy type)."""
+    dtype = np.dtype(dtype)
+    if dtype.name not in WORKING_DTYPES:
+        raise ValueError(f"Type d'image non géré : {dtype}")
+    return dtype
+
+
+def to_image(data, stretch_method="linear", header=None, dtype=np.uint8):
+    """Normalizes FITS data to an OpenCV image of type ``dtype`` (BGR for colour)."""
+    image = stretch.normalize(data, stretch_method, header, working_dtype(dtype))
+    if image.ndim == 3:
+        if image.shape[0] == 3:
+            image = np.transpose(image, (1, 2, 0))
+        image = cv.cvtColor(image, cv.COLOR_RGB2BGR)
+    return image
+
+
+def to_uint8_image(data, stretch_method="linear", header=None):
+    """Normalizes FITS data to an 8-bit OpenCV image (BGR for colour)."""
+    return to_image(data, stretch_method, header)
+
+
+def load_image(source, stretch_method="linear", dtype=np.uint8):
+    """Loads a FITS file (path or bytes) as an OpenCV image of type ``dtype``."""
+    data, header = read_fits(source)
+    return to_image(data, stretch_method, header, dtype)
+
+
+def _png_image(image):
+    """8-bit images as they are, the others as 16-bit images."""
+    if image.dtype == np.float32:
+        return (np.clip(image, 0.0, 1.0) * 65535.0 + 0.5).astype(np.uint16)
+    return image
+
+
+def encode_image(image):
+    """Encodes a result as PNG bytes (16-bit above 8 bits)."""
+    ok, buf = cv.imencode(".png", _png_image(image))
+    if not ok:
+        raise RuntimeError("Encodage PNG impossible")
+    return buf.tobytes()
+
+
+def save_image(path, image):
+    """Writes a result : float32 FITS for .fits / .fit, otherwise OpenCV.
+
+    FITS data keeps the working range (e.g. [0, 1] for a float32 image is
+    written as is, a uint16 image is scaled to [0, 1]), colour images as RGB
+    planes. PNG files are 16-bit above 8 bits.
+    """
+    if not path.lower().endswith(FITS_EXTENSIONS):
+        return cv.imwrite(path, _png_image(image))
+
+    data = image.astype(np.float32, copy=False)
+    if image.dtype != np.float32:
+        data = data / np.float32(stretch.output_max(image.dtype))
+    if data.ndim == 3:
+        data = np.transpose(cv.cvtColor(data, cv.COLOR_BGR2RGB), (2, 0, 1))
+    fits.writeto(path, data, overwrite=True)
+    return True
+
+
+def merge_params(params=None):
+    """Returns a full parameter dict, missing keys taking their default value."""
+    merged = dict(DEFAULT_PARAMS)
+    if params:
+        merged.update(params)
+    return merged
+
+
+def check_params(params):
+    """Raises ValueError for an unknown, mistyped or out of range parameter."""
+    for name, value in params.items():
+        if name not in PARAM_LIMITS:
+            raise ValueError(f"Paramètre inconnu : {name}")
+        types = (int, float) if name in FLOAT_PARAMS else (int,)
+        mistyped = isinstance(value, bool) and name != "adaptive"
+        if mistyped or not isinstance(value, types):
+            kind = "un nombre" if name in FLOAT_PARAMS else "un entier"
+            raise ValueError(f"{name} doit être {kind} (reçu : {value!r})")
+        low, high, odd = PARAM_LIMITS[name]
+        if not low <= value <= high:
+            raise ValueError(f"{name} doit être entre {low} et {high} (reçu : {value})")
+        if odd and value % 2 == 0:
+            raise ValueError(f"{name} doit être impair (reçu : {value})")
+
+
+def build_star_mask(gray, params):
+    """Adaptive threshold, opening and dilation of the star mask."""
+    # Constant cost whatever the kernel sizes (see fast_filters.py)
+    return fast_filters.star_mask(
+        gray,
+        params["thresh_block"],
+        params["thresh_c"],
+        params["opening_kernel"],
+        params["dilate_iter"],
+    )
+
+
+def erode(image, params, report=None):
+    """Erosion of the whole image, by bands of rows."""
+    size = params["erosion_size"]
+    iterations = params["erosion_iter"]
+    kernel_img = np.ones((size, size), np.uint8)
+    # Rows read above and below a band
+    halo = iterations * (size // 2)
+
+    height = image.shape[0]
+    bands = range(0, height, TILE_ROWS)
+    image_eroded = np.empty_like(image)
+    for i, y in enumerate(bands):
+        y0, y1 = max(y - halo, 0), min(y + TILE_ROWS + halo, height)
+        band = cv.erode(image[y0:y1], kernel_img, iterations=iterations)
+        image_eroded[y : y + TILE_ROWS] = band[y - y0 : y - y0 + TILE_ROWS]
+        if report is not None:
+            report(i + 1, len(bands))
+    return image_eroded
+
+
+def _inpaint_telea(image, mask, radius):
+    """cv.inpaint, channel by channel for colour images above 8 bits.
+
+    OpenCV only inpaints 16-bit and float32 images with a single channel.
+    """
+    if image.ndim == 2 or image.dtype == np.uint8:
+        return cv.inpaint(image, mask, radius, cv.INPAINT_TELEA)
+    return cv.merge(
+        [cv.inpaint(channel, mask, radius, cv.INPAINT_TELEA) for channel in cv.split(image)]
+    )
+
+
+def inpaint(image, mask, radius, report=None):
+    """cv.inpaint (TELEA) computed by bands of rows, with the same result.
+
+    Stars closer than twice the radius influence each other : such groups are
+    inpainted together, in the band where they start, with the pixels around
+    them that the inpainting reads. The progress counts masked pixels, the
+    cost of the inpainting depending on them.
+
+    Bands are independent and processed by a thread pool (see the "tiles"
+    workload of thread_policy.py).
+    """
+    grow_kernel = cv.getStructuringElement(
+        cv.MORPH_ELLIPSE, (2 * radius + 1, 2 * radius + 1)
+    )
+    count, labels, stats, _ = cv.connectedComponentsWithStats(
+        cv.dilate(mask, grow_kernel)
+    )
+    top = stats[1:, cv.CC_STAT_TOP]
+    bottom = top + stats[1:, cv.CC_STAT_HEIGHT]
+    margin = radius + 2  # The gradient of the known pixels reads 2 more pixels
+
+    height = image.shape[0]
+    result = image.copy()
+
+    def inpaint_band(y):
+        groups = np.flatnonzero((top >= y) & (top < y + TILE_ROWS))
+        if groups.size == 0:
+            return 0
+        y0 = max(int(top[groups].min()) - margin, 0)
+        y1 = min(int(bottom[groups].max()) + margin, height)
+
+        selected = np.zeros(count, bool)
+        selected[groups + 1] = True
+        band_mask = selected[labels[y0:y1]] & (mask[y0:y1] > 0)
+        band = _inpaint_telea(image[y0:y1], band_mask.view(np.uint8), radius)
+        # Each masked pixel belongs to a single band
+        result[y0:y1][band_mask] = band[band_mask]
+        return int(np.count_nonzero(band_mask))
+
+    total = cv.countNonZero(mask)
+    done = 0
+    if report is not None:
+        report(done, total)
+
+    bands = range(0, height, TILE_ROWS)
+    pool = ThreadPoolExecutor(thread_policy.plan("tiles", len(bands)).workers)
+    try:
+        for future in as_completed([pool.submit(inpaint_band, y) for y in bands]):
+            done += future.result()
+            if report is not None:
+                report(done, total)
+    finally:
+        # Cancelled : the bands not started yet are dropped
+        pool.shutdown(cancel_futures=True)
+    return result
+
+
+def fuse(image, inpainted, mask_dilated, params, report=None):
+    """Alpha blending between the original and the starless image."""
+    k_blur = params["blur_kernel"]
+    alpha = params["reduction_alpha"] / 100.0
+    full_scale = stretch.output_max(image.dtype)
+
+    mask_blurred = fast_filters.gaussian_blur(mask_dilated, k_blur)
+
+    # Blending by bands : no full size float32 temporaries
+    height = image.shape[0]
+    bands = range(0, height, TILE_ROWS)
+    final_image = np.empty_like(image)
+    for i, y in enumerate(bands):
+        rows = slice(y, y + TILE_ROWS)
+        M = mask_blurred[rows].astype(np.float32) / 255.0
+        if image.ndim == 3:
+            M = np.stack([M] * 3, axis=-1)
+
+        # No copy for float32 images
+        Ioriginal = image[rows].astype(np.float32, copy=False)
+        Ieroded = inpainted[rows].astype(np.float32, copy=False)
+
+        final_image_float = (M * alpha * Ieroded) + (1.0 - (M * alpha)) * Ioriginal
+        # Back to the working type (truncated, like the historical 8-bit path)
+        final_image[rows] = np.clip(final_image_float, 0, full_scale)
+        if report is not None:
+            report(i + 1, len(bands))
+    return final_image
+
+
+def reduce_stars(image, params=None, timings=None, progress=None, cancel=None):
+    """Runs the full Phase 3 pipeline on an image of a WORKING_DTYPES type.
+
+    Returns a dict with the "mask", "eroded" and "final" images (in the
+    adaptive mode : the changed pixels, the starless image and the final
+    image). When a
+    ``timings`` dict is given, the duration (seconds) of each stage of
+    ``STAGES`` is stored in it.
+
+    ``progress(stage, done, total)`` is called at the start of each stage and
+    after each band (see overall_progress for the fraction of the whole run).
+    ``cancel`` is a CancelToken checked at the same points : the run stops by
+    raising Cancelled.
+    """
+    working_dtype(image.dtype)
+    params = merge_params(params)
+    if timings is None:
+        timings = {}
+    reports = {stage: _reporter(stage, progress, cancel) for stage in STAGES}
+    if params["adaptive"]:
+        return _reduce_stars_adaptive(image, params, timings, reports)
+
+    # 1. Full image erosion
+    t0 = time.perf_counter()
+    reports["erosion"](0, 1)
+    image_eroded = erode(image, params, reports["erosion"])
+    t1 = time.perf_counter()
+    timings["erosion"] = t1 - t0
+
+    # 2. Star mask
+    reports["mask"](0, 1)
+    gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    mask_dilated = build_star_mask(gray, params)
+    reports["mask"](1, 1)
+    t2 = time.perf_counter()
+    timings["mask"] = t2 - t1
+
+    # 3. Inpainting of the eroded image
+    eroded_final = inpaint(
+        image_eroded, mask_dilated, params["inpaint_radius"], reports["inpaint"]
+    )
+    t3 = time.perf_counter()
+    timings["inpaint"] = t3 - t2
+
+    # 4. Fusion
+    reports["fusion"](0, 1)
+    final_image = fuse(image, eroded_final, mask_dilated, params, reports["fusion"])
+    timings["fusion"] = time.perf_counter() - t3
+
+    return {"mask": mask_dilated, "eroded": eroded_final, "final": final_image}
+
+
+def _reduce_stars_adaptive(image, params, timings, reports):
+    """Per-star mode of reduce_stars (no erosion stage)."""
+    # 1. Star cores (no dilation : each star gets its own halo)
+    t0 = time.perf_counter()
+    reports["mask"](0, 1)
+    gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    detected = fast_filters.detect_stars(
+        gray, params["thresh_block"], params["thresh_c"], params["opening_kernel"]
+    )
+    reports["mask"](1, 1)
+    t1 = time.perf_counter()
+    timings["mask"] = t1 - t0
+
+    # 2. Background of each star, in its own window, written to copies of the
+    # image batch after batch (no separate fusion stage)
+    results = star_catalog.reduce_each_star(
+        image, gray, detected, params, reports["inpaint"]
+    )
+    t2 = time.perf_counter()
+    timings["inpaint"] = t2 - t1
+
+    reports["fusion"](1, 1)
+    timings["fusion"] = time.perf_counter() - t2
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+    import tracemalloc
+
+    if len(sys.argv) > 1:
+        data, header = read_fits(sys.argv[1])
+    else:
+        # Synthetic 12 Mpx 16-bit camera frame with stars
+        rng = np.random.default_rng(0)
+        data = rng.normal(1000.0, 30.0, (3000, 4000)).astype(np.uint16)
+        ys, xs = rng.integers(2, 2998, 10000), rng.integers(2, 3998, 10000)
+        for y, x in zip(ys, xs):
+            data[y - 2 : y + 3, x - 2 : x + 3] += np.uint16(rng.integers(500, 20000))
+        header = None
+
+    print(f"Données : {data.shape} {data.dtype}\n")
+    print("Type     normalisation (s)  traitement (s)  Mpx/s  pic mémoire (Mo)  niveaux")
+    for name in WORKING_DTYPES:
+        # Peak of the numpy / OpenCV output arrays (OpenCV internal buffers
+        # are not traced)
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        image = to_image(data, "linear", header, name)
+        t1 = time.perf_counter()
+        final = reduce_stars(image)["final"]
+        t2 = time.perf_counter()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        mpx = image.shape[0] * image.shape[1] / 1e6
+        levels = len(np.unique(final[::7, ::7]))
+        print(
+            f"{name:<8} {t1 - t0:17.2f}  {t2 - t1:14.2f}  {mpx / (t2 - t1):5.2f}"
+            f"  {peak / 2**20:16.0f}  {levels:7d}"
+        )
@@ -0,0 +1,252 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Normalization stage (FITS data -> uint8 / uint16 / float32 image).
+#
+# Available stretches :
+#   - linear     : global min/max (historical behaviour), DATAMIN/DATAMAX
+#                  header keywords are used when present.
+#   - percentile : linear between two percentiles, a hot pixel no longer
+#                  crushes the histogram.
+#   - asinh      : percentile clip followed by an arcsinh curve (faint details).
+#   - midtone    : midtones transfer function (auto-stretch, like PixInsight
+#                  STF) placing the sky background at a target gray level.
+#
+# Statistics are estimated on a strided subsample of the frame. Linear
+# stretches are applied in a single fused scale/offset pass (OpenCV, float32)
+# followed by a clip and a truncation to the output type (same gray levels as
+# the historical float64 code), the other curves through a lookup table :
+# directly indexed by the pixel value for 8/16-bit integer data, or after that
+# same quantization pass for floating point data. No float64 full-size
+# temporaries are created.
+#
+# Integer outputs use their whole range, float32 outputs the range [0, 1].
+#
+# Use : python stretch.py [FITS_FILE]  (benchmark against the float64 path)
+
+import time
+
+import cv2 as cv
+import numpy as np
+
+STRETCHES = ("linear", "percentile", "asinh", "midtone")
+
+# Maximum number of pixels used to estimate the statistics
+STATS_SAMPLES = 250_000
+# Number of LUT entries used for floating point data
+LUT_SIZE = 65536
+
+# Input types handled natively by OpenCV, and output types
+CV_DEPTHS = {
+    np.dtype(np.uint8): cv.CV_8U,
+    np.dtype(np.int8): cv.CV_8S,
+    np.dtype(np.uint16): cv.CV_16U,
+    np.dtype(np.int16): cv.CV_16S,
+    np.dtype(np.int32): cv.CV_32S,
+    np.dtype(np.float32): cv.CV_32F,
+    np.dtype(np.float64): cv.CV_64F,
+}
+
+# Default curve settings
+LOW_PERCENTILE = 0.25
+HIGH_PERCENTILE = 99.75
+ASINH_BETA = 10.0
+TARGET_BACKGROUND = 0.25
+SHADOWS_CLIP = -2.8  # In normalized MAD units below the median
+
+
+def output_max(dtype):
+    """Full scale value of an image type (1.0 for floating point images)."""
+    dtype = np.dtype(dtype)
+    return 1.0 if dtype.kind == "f" else np.iinfo(dtype).max
+
+
+def sample_pixels(data, max_samples=STATS_SAMPLES):
+    """Returns a strided subsample (finite values only) of the data."""
+    flat = data.reshape(-1)
+    step = max(1, flat.size // max_samples)
+    sample = flat[::step].astype(np.float32)
+    return sample[np.isfinite(sample)]
+
+
+def header_range(header):
+    """Returns (DATAMIN, DATAMAX) from a FITS header, or None."""
+    if header is None:
+        return None
+    lo, hi = header.get("DATAMIN"), header.get("DATAMAX")
+    if lo is None or hi is None or not hi > lo:
+        return None
+    return float(lo), float(hi)
+
+
+def compute_levels(
+    data,
+    method="linear",
+    header=None,
+    low=LOW_PERCENTILE,
+    high=HIGH_PERCENTILE,
+):
+    """Returns the input range (lo, hi) and, for "midtone", the sample."""
+    if method not in STRETCHES:
+        raise ValueError(f"Étirement inconnu : {method}")
+
+    if method == "linear":
+        levels = header_range(header)
+        if levels is None:
+            # Exact extrema keep the historical output
+            levels = float(np.nanmin(data)), float(np.nanmax(data))
+        return levels, None
+
+    sample = sample_pixels(data)
+    if method == "midtone":
+        return (float(sample.min()), float(sample.max())), sample
+
+    lo, hi = np.percentile(sample, (low, high))
+    return (float(lo), float(hi)), sample
+
+
+def midtone_balance(sample, lo, hi, target=TARGET_BACKGROUND):
+    """Shadows clip and midtones balance (both in [0, 1]) for a sample."""
+    x = (sample - lo) / (hi - lo)
+    median = float(np.median(x))
+    mad = float(np.median(np.abs(x - median))) * 1.4826
+    shadows = min(max(median + SHADOWS_CLIP * mad, 0.0), 1.0)
+    # MTF(m, median - shadows) = target  <=>  m = MTF(target, median - shadows)
+    m = mtf(target, min(max(median - shadows, 0.0), 1.0))
+    return shadows, m
+
+
+def mtf(m, x):
+    """Midtones transfer function (0 -> 0, m -> 0.5, 1 -> 1)."""
+    x = np.asarray(x, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        y = (m - 1.0) * x / ((2.0 * m - 1.0) * x - m)
+    return np.where(x <= 0, 0.0, np.where(x >= 1, 1.0, y))
+
+
+def curve(method, x, shadows=0.0, midtones=0.5, beta=ASINH_BETA):
+    """Applies the stretch curve to normalized values x in [0, 1]."""
+    if method == "asinh":
+        return np.arcsinh(beta * x) / np.arcsinh(beta)
+    if method == "midtone":
+        x = np.clip((x - shadows) / (1.0 - shadows), 0.0, 1.0)
+        return mtf(midtones, x)
+    return x
+
+
+def build_lut(values, lo, hi, method, out_dtype, **curve_params):
+    """LUT giving the output value of each input value of ``values``."""
+    out_max = output_max(out_dtype)
+    x = np.clip((values.astype(np.float64) - lo) / (hi - lo), 0.0, 1.0)
+    y = curve(method, x, **curve_params)
+    return (y * out_max).astype(out_dtype)
+
+
+def _quantize(data, lo, hi, out_max, out_dtype):
+    """Maps [lo, hi] onto [0, out_max] in one fused scale/offset pass.
+
+    Integer outputs are truncated, not rounded, like the historical
+    ``(x * 255).astype(uint8)`` (and like build_lut).
+    """
+    if not data.dtype.isnative:
+        # FITS data is big-endian
+        data = data.astype(data.dtype.newbyteorder("="))
+    if data.dtype not in CV_DEPTHS:
+        data = data.astype(np.float32)
+
+    # 2D view so that OpenCV never mistakes an axis for channels
+    shape = data.shape
+    src = data.reshape(-1, shape[-1])
+    k = out_max / (hi - lo)
+    out = cv.addWeighted(src, k, src, 0, -lo * k, dtype=cv.CV_32F)
+    # Not saturated : NaN -> 0, then clipped in place
+    cv.patchNaNs(out, 0)
+    np.clip(out, 0, out_max, out=out)
+    if out_dtype.kind != "f":
+        out = out.astype(out_dtype)
+    return out.reshape(shape)
+
+
+def normalize(
+    data,
+    method="linear",
+    header=None,
+    out_dtype=np.uint8,
+    low=LOW_PERCENTILE,
+    high=HIGH_PERCENTILE,
+    beta=ASINH_BETA,
+    target=TARGET_BACKGROUND,
+):
+    """Stretches FITS data into an image of type ``out_dtype``.
+
+    Integer types get their full range, float32 the range [0, 1].
+    """
+    out_dtype = np.dtype(out_dtype)
+    (lo, hi), sample = compute_levels(data, method, header, low, high)
+    if not hi > lo:
+        return np.zeros(data.shape, out_dtype)
+
+    # 1. Linear stretches : no curve, straight to the output range
+    if method in ("linear", "percentile"):
+        return _quantize(data, lo, hi, output_max(out_dtype), out_dtype)
+
+    curve_params = {}
+    if method == "asinh":
+        curve_params["beta"] = beta
+    elif method == "midtone":
+        shadows, midtones = midtone_balance(sample, lo, hi, target)
+        curve_params.update(shadows=shadows, midtones=midtones)
+
+    # 2. 8/16-bit integer data : the value itself indexes the LUT
+    if (data.dtype.kind in "ui" and data.dtype.itemsize == 2) or data.dtype == np.uint8:
+        if not data.dtype.isnative:
+            data = data.astype(data.dtype.newbyteorder("="))
+        info = np.iinfo(data.dtype)
+        values = np.arange(info.min, info.max + 1)
+        lut = build_lut(values, lo, hi, method, out_dtype, **curve_params)
+        if data.dtype == np.int16:
+            # Flipping the sign bit maps [-32768, 32767] onto [0, 65535]
+            return lut[data.view(np.uint16) ^ np.uint16(0x8000)]
+        return lut[data]
+
+    # 3. Other data : quantized on LUT_SIZE levels, then through the LUT
+    indices = _quantize(data, lo, hi, LUT_SIZE - 1, np.dtype(np.uint16))
+    values = lo + np.arange(LUT_SIZE) * ((hi - lo) / (LUT_SIZE - 1))
+    lut = build_lut(values, lo, hi, method, out_dtype, **curve_params)
+    return lut[indices]
+
+
+if __name__ == "__main__":
+    import sys
+
+    from astropy.io import fits
+
+    if len(sys.argv) > 1:
+        with fits.open(sys.argv[1]) as hdul:
+            data = np.asarray(hdul[0].data)
+    else:
+        # Synthetic 24 Mpx 16-bit camera frame with a few hot pixels
+        rng = np.random.default_rng(0)
+        data = rng.normal(1000.0, 30.0, (4000, 6000)).astype(np.uint16)
+        data[rng.integers(0, 4000, 50), rng.integers(0, 6000, 50)] = 65000
+
+    def legacy(d):
+        return ((d - d.min()) / (d.max() - d.min()) * 255).astype("uint8")
+
+    def bench(label, func):
+        func()  # Warm-up
+        t0 = time.perf_counter()
+        for _ in range(3):
+            out = func()
+        elapsed = (time.perf_counter() - t0) / 3
+        levels = len(np.unique(out[::7, ::7]))
+        print(f"{label:<20} {elapsed * 1000:8.1f} ms  {levels:4d} niveaux de gris")
+
+    print(f"Données : {data.shape} {data.dtype}")
+    bench("float64 (actuel)", lambda: legacy(data))
+    for method in STRETCHES:
+        bench(method, lambda m=method: normalize(data, m))
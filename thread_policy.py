@@ -0,0 +1,192 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Execution policy : how many threads and processes each workload uses.
+#
+# OpenCV starts one thread per core for each call, and so does BLAS. Running
+# N worker processes (or N tiles in threads) on top of that gives N threads
+# per core. The policy splits the available cores instead :
+#
+#   - interactive : one image at a time, OpenCV / BLAS use every core.
+#   - batch       : N worker processes (one file each), cores / N threads in
+#                   each of them.
+#   - tiles       : independent bands of one image processed by a thread
+#                   pool inside a process, within the threads of that process.
+#
+# Settings, by priority : configure() (API), then the environment variables
+# STAR_REDUCTION_CPUS (cores available), STAR_REDUCTION_WORKERS (processes of
+# the batch modes) and STAR_REDUCTION_THREADS (threads per process).
+#
+# Use : python thread_policy.py [FITS_FILE]  (throughput from 1 to N cores)
+
+import os
+import time
+
+import cv2 as cv
+
+try:
+    # Optional : limits the BLAS threads of an already started process
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+WORKLOADS = ("interactive", "batch", "tiles")
+
+ENV_CPUS = "STAR_REDUCTION_CPUS"
+ENV_WORKERS = "STAR_REDUCTION_WORKERS"
+ENV_THREADS = "STAR_REDUCTION_THREADS"
+# Read by BLAS libraries when they start (worker processes)
+BLAS_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+# Values given to configure(), they win over the environment
+_settings = {"cpus": None, "workers": None, "threads": None}
+# Threads of this process, once a plan has been applied
+_process_threads = None
+
+
+class ThreadPlan:
+    """Workers (processes or tile threads) and threads per worker."""
+
+    def __init__(self, workload, workers, threads):
+        self.workload = workload
+        self.workers = workers
+        self.threads = threads
+
+    def __repr__(self):
+        return (
+            f"ThreadPlan({self.workload}, workers={self.workers}, "
+            f"threads={self.threads})"
+        )
+
+
+def configure(cpus=None, workers=None, threads=None):
+    """Overrides the environment (None keeps the environment / default)."""
+    _settings.update(cpus=cpus, workers=workers, threads=threads)
+
+
+def _setting(name, env):
+    value = _settings[name]
+    if value is None and os.environ.get(env):
+        value = int(os.environ[env])
+    return value
+
+
+def available_cpus():
+    """Cores this application may use (affinity mask by default)."""
+    cpus = _setting("cpus", ENV_CPUS)
+    if cpus is None:
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:  # Not available on macOS / Windows
+            cpus = os.cpu_count() or 1
+    return max(cpus, 1)
+
+
+def process_threads():
+    """Threads this process may use (set by apply, all cores by default)."""
+    if _process_threads is not None:
+        return _process_threads
+    return _setting("threads", ENV_THREADS) or available_cpus()
+
+
+def plan(workload, tasks=None, workers=None):
+    """ThreadPlan of a workload of ``tasks`` files or tiles (None : unknown).
+
+    ``workers`` forces the number of batch processes (e.g. a --workers option).
+    """
+    if workload not in WORKLOADS:
+        raise ValueError(f"Charge de travail inconnue : {workload}")
+
+    if workload == "tiles":
+        # Shares the threads of the current process between the tiles
+        budget = process_threads()
+        workers = min(budget, tasks or budget)
+        return ThreadPlan(workload, workers, max(budget // workers, 1))
+
+    cpus = available_cpus()
+    if workload == "interactive":
+        workers = 1
+    elif workers is None:
+        workers = _setting("workers", ENV_WORKERS) or min(cpus, tasks or cpus)
+    threads = _setting("threads", ENV_THREADS) or max(cpus // workers, 1)
+    return ThreadPlan(workload, workers, threads)
+
+
+def apply(thread_plan):
+    """Limits OpenCV and BLAS of this process to the threads of the plan."""
+    global _process_threads
+    _process_threads = thread_plan.threads
+    cv.setNumThreads(thread_plan.threads)
+    for name in BLAS_ENV:
+        os.environ[name] = str(thread_plan.threads)
+    if threadpool_limits is not None:
+        threadpool_limits(thread_plan.threads)
+
+
+def init_worker(threads):
+    """Initializer of the batch worker processes (see plan("batch"))."""
+    apply(ThreadPlan("worker", 1, threads))
+
+
+if __name__ == "__main__":
+    import sys
+    from concurrent.futures import ProcessPoolExecutor
+
+    import numpy as np
+
+    import star_pipeline
+
+    if len(sys.argv) > 1:
+        image = star_pipeline.load_image(sys.argv[1])
+    else:
+        # Synthetic 12 Mpx star field
+        rng = np.random.default_rng(0)
+        image = rng.normal(40, 6, (3000, 4000)).clip(0, 255).astype(np.uint8)
+        ys, xs = rng.integers(0, 3000, 10000), rng.integers(0, 4000, 10000)
+        for y, x in zip(ys, xs):
+            image[max(y - 2, 0) : y + 3, max(x - 2, 0) : x + 3] += 60
+
+    total = available_cpus()
+    counts = sorted({1, total} | {2**i for i in range(total.bit_length()) if 2**i < total})
+    files = 2 * total  # Files of the batch runs
+
+    def run_single():
+        return star_pipeline.reduce_stars(image)
+
+    print(f"Image : {image.shape}, {total} cœurs disponibles\n")
+    print("Cœurs  image seule (s)  batch (images/s)  batch sans politique")
+    for cpus in counts:
+        configure(cpus=cpus)
+
+        # 1. Interactive : a single image, OpenCV threads + inpainting tiles
+        apply(plan("interactive"))
+        run_single()  # Warm-up
+        t0 = time.perf_counter()
+        run_single()
+        single = time.perf_counter() - t0
+
+        # 2. Batch : cpus worker processes, threads split between them
+        batch = plan("batch", files)
+        with ProcessPoolExecutor(
+            batch.workers, initializer=init_worker, initargs=(batch.threads,)
+        ) as pool:
+            list(pool.map(star_pipeline.reduce_stars, [image] * batch.workers))
+            t0 = time.perf_counter()
+            list(pool.map(star_pipeline.reduce_stars, [image] * files))
+            throughput = files / (time.perf_counter() - t0)
+
+        # 3. Same batch, every worker using every core (oversubscription)
+        with ProcessPoolExecutor(
+            batch.workers, initializer=init_worker, initargs=(total,)
+        ) as pool:
+            list(pool.map(star_pipeline.reduce_stars, [image] * batch.workers))
+            t0 = time.perf_counter()
+            list(pool.map(star_pipeline.reduce_stars, [image] * files))
+            oversubscribed = files / (time.perf_counter() - t0)
+
+        print(f"{cpus:5d}  {single:15.2f}  {throughput:16.2f}  {oversubscribed:20.2f}")
+    configure()
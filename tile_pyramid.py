@@ -0,0 +1,187 @@
+# SAE - Star reduction
+#
+# Groupe 2 :
+# - AMEDRO Louis (Osiris-Sio)
+# - HERBAUX Jules (Lirei159)
+# - PACE--BOULNOIS Lysandre (NovaChocolat)
+#
+# Tiled multi-resolution images for the comparison panes.
+#
+# Level 0 is the full resolution image, each next level halves the previous
+# one (area average) down to a level that fits in a single tile. Levels are
+# built on first use, and the displayed tiles (RGB, ready for a QImage) are
+# kept in an LRU cache : panning or zooming back only converts the tiles that
+# were never shown.
+#
+# The difference heatmap is a pyramid of its own whose tiles are computed from
+# the tiles of the two compared images, only when they are displayed. Its
+# colour scale (min/max of the difference) comes from one scan of the full
+# resolution images, when the first tile is drawn.
+
+import abc
+
+import cv2 as cv
+import numpy as np
+
+from render_cache import RenderCache
+
+TILE_SIZE = 256
+# Memory limit of the displayed tiles of one pyramid (bytes)
+DEFAULT_TILE_CACHE_BYTES = 128 * 1024 * 1024
+# Number of rows read at once when scanning the full resolution difference
+SCAN_ROWS = 1024
+
+
+def match_channels(img1, img2):
+    """Converts the colour image of a colour / monochrome pair to grayscale."""
+    if img1.ndim != img2.ndim:
+        if img1.ndim == 3:
+            img1 = cv.cvtColor(img1, cv.COLOR_BGR2GRAY)
+        else:
+            img2 = cv.cvtColor(img2, cv.COLOR_BGR2GRAY)
+    return img1, img2
+
+
+def difference_gray(img1, img2):
+    """Absolute difference of two images as a single intensity layer."""
+    img1, img2 = match_channels(img1, img2)
+    diff = cv.absdiff(img1, img2)
+    if diff.ndim == 3:
+        diff = cv.cvtColor(diff, cv.COLOR_BGR2GRAY)
+    return diff
+
+
+class TiledImage(abc.ABC):
+    """Tiles of an image at every zoom level, kept in an LRU cache.
+
+    Subclasses give the size of each level (level_shape) and render the
+    tiles (_render_tile).
+    """
+
+    def __init__(self, width, height, max_bytes=DEFAULT_TILE_CACHE_BYTES):
+        self.width, self.height = width, height
+        self.tiles = RenderCache(max_bytes)
+
+        self.level_count = 1
+        w, h = width, height
+        while max(w, h) > TILE_SIZE:
+            w, h = (w + 1) // 2, (h + 1) // 2
+            self.level_count += 1
+
+    @abc.abstractmethod
+    def level_shape(self, index):
+        """(width, height) of a level."""
+
+    @abc.abstractmethod
+    def _render_tile(self, level, x, y):
+        """Tile of a level whose top left corner is (x, y) (level pixels)."""
+
+    def level_for_zoom(self, zoom):
+        """Smallest level still having one pixel per screen pixel or more."""
+        level = 0
+        while level + 1 < self.level_count and zoom * 2 ** (level + 1) <= 1:
+            level += 1
+        return level
+
+    def tile(self, level, tx, ty):
+        """RGB (or grayscale) tile, contiguous in memory."""
+        key = (level, tx, ty)
+        tile = self.tiles.get(key)
+        if tile is None:
+            x, y = tx * TILE_SIZE, ty * TILE_SIZE
+            tile = np.ascontiguousarray(self._render_tile(level, x, y))
+            self.tiles.put(key, tile)
+        return tile
+
+    def visible_tiles(self, level, x0, y0, x1, y1):
+        """Tiles covering the area [x0, x1[ x [y0, y1[ (level 0 pixels).
+
+        Yields (tile, (x, y, w, h)) with the area of each tile in level 0
+        pixels.
+        """
+        level_w, level_h = self.level_shape(level)
+        sx, sy = self.width / level_w, self.height / level_h
+
+        first_tx = max(int(x0 / sx) // TILE_SIZE, 0)
+        first_ty = max(int(y0 / sy) // TILE_SIZE, 0)
+        last_tx = min(int(x1 / sx) // TILE_SIZE, (level_w - 1) // TILE_SIZE)
+        last_ty = min(int(y1 / sy) // TILE_SIZE, (level_h - 1) // TILE_SIZE)
+
+        for ty in range(first_ty, last_ty + 1):
+            for tx in range(first_tx, last_tx + 1):
+                tile = self.tile(level, tx, ty)
+                th, tw = tile.shape[:2]
+                x, y = tx * TILE_SIZE, ty * TILE_SIZE
+                yield tile, (x * sx, y * sy, tw * sx, th * sy)
+
+
+class TilePyramid(TiledImage):
+    """Tiles of an 8-bit image (BGR or grayscale) at every zoom level."""
+
+    def __init__(self, image, max_bytes=DEFAULT_TILE_CACHE_BYTES):
+        h, w = image.shape[:2]
+        super().__init__(w, h, max_bytes)
+        self.levels = [image]
+
+    def level(self, index):
+        """Image of a level (built from the previous one on first use)."""
+        while len(self.levels) <= index:
+            previous = self.levels[-1]
+            h, w = previous.shape[:2]
+            size = ((w + 1) // 2, (h + 1) // 2)
+            self.levels.append(cv.resize(previous, size, interpolation=cv.INTER_AREA))
+        return self.levels[index]
+
+    def level_shape(self, index):
+        h, w = self.level(index).shape[:2]
+        return w, h
+
+    def _render_tile(self, level, x, y):
+        tile = self.level(level)[y : y + TILE_SIZE, x : x + TILE_SIZE]
+        if tile.ndim == 3:
+            return cv.cvtColor(tile, cv.COLOR_BGR2RGB)
+        return tile
+
+
+class HeatmapPyramid(TiledImage):
+    """Difference heatmap (Red=Max Diff, Blue=Min Diff) of two pyramids.
+
+    Both pyramids must have the same size. The colour scale is the min/max of
+    the full resolution difference, like ComparisonModel.compute_difference :
+    the first tile costs one scan of the full resolution images (by bands of
+    SCAN_ROWS rows), the next ones only their own pixels.
+    """
+
+    def __init__(self, original, processed, max_bytes=DEFAULT_TILE_CACHE_BYTES):
+        super().__init__(original.width, original.height, max_bytes)
+        self.original = original
+        self.processed = processed
+        self.range = None
+
+    def level_shape(self, index):
+        return self.original.level_shape(index)
+
+    def difference_range(self):
+        """(min, max) of the full resolution difference, scanned by bands."""
+        if self.range is None:
+            img1, img2 = self.original.level(0), self.processed.level(0)
+            lo, hi = 255.0, 0.0
+            for y in range(0, self.height, SCAN_ROWS):
+                diff = difference_gray(img1[y : y + SCAN_ROWS], img2[y : y + SCAN_ROWS])
+                band_lo, band_hi = cv.minMaxLoc(diff)[:2]
+                lo, hi = min(lo, band_lo), max(hi, band_hi)
+            self.range = lo, hi
+        return self.range
+
+    def _render_tile(self, level, x, y):
+        area = (slice(y, y + TILE_SIZE), slice(x, x + TILE_SIZE))
+        diff = difference_gray(
+            self.original.level(level)[area], self.processed.level(level)[area]
+        )
+
+        # Same normalization as the full image heatmap, then JET colormap
+        lo, hi = self.difference_range()
+        scale = 255.0 / (hi - lo) if hi > lo else 0.0
+        diff_norm = cv.convertScaleAbs(diff, alpha=scale, beta=-lo * scale)
+        heatmap = cv.applyColorMap(diff_norm, cv.COLORMAP_JET)
+        return cv.cvtColor(heatmap, cv.COLOR_BGR2RGB)